@@ -6,7 +6,7 @@ from datetime import datetime, timedelta
 from memory import Memory
 
 class Agent:
-    def __init__(self, file_name: str, name: str, agent_type: str, intermediate_belief: str, intermediate_belief_depression: str, history:str, behavior:str, description: list, auto_thought:str, situation:str, model="gpt-4o"):
+    def __init__(self, file_name: str, name: str, agent_type: str, intermediate_belief: str, intermediate_belief_depression: str, history:str, behavior:str, description: list, auto_thought:str, situation:str, model="gpt-4o", memory_data=None):
         self.name = name
         self.agent_type = agent_type
         self.intermediate_belief = intermediate_belief
@@ -16,7 +16,7 @@ class Agent:
         self.model = model
         self.auto_thought = auto_thought
         self.situation = situation
-        self.llm = OpenAILLM(llm_model_name=self.model, embedding_model_name="text-embedding-ada-002")
+        self.llm = OpenAILLM(llm_model_name=self.model, embedding_model_name="text-embedding-ada-002", agent_name=self.name)
         self.description = description
         self.state = "idle"
 
@@ -37,7 +37,8 @@ class Agent:
 
         self.memory = Memory(
             memory_path = file_name,
-            persona=self.persona
+            persona=self.persona,
+            memory_data=memory_data
         )
         self.memory.short_term_memory.long_term_memory.set_reflection_callback(self.handle_reflection)
 
@@ -56,7 +57,6 @@ class Agent:
         )
 
         self.memory.short_term_memory.description = self.description
-        self.memory.memory_retrieval.short_memory.description = self.description
 
     def handle_reflection(self, reflection_entry):
         self.update_persona_description()
@@ -68,7 +68,6 @@ class Agent:
 
         self.plan.description = self.description
         self.memory.short_term_memory.description = self.description
-        self.memory.memory_retrieval.short_memory.description = self.description
         self.persona.description = self.description
 
     def update_relationship(self, other_agent_name, interaction_text):       
@@ -84,7 +83,7 @@ class Agent:
         Return only the numeric score.
         """
 
-        score_response = self.llm.get_llm_response(prompt).strip()
+        score_response = self.llm.get_llm_response(prompt, call_site="relationship_score").strip()
 
         try:
             score = float(score_response)
@@ -122,5 +121,5 @@ class Agent:
         prompt = f"""How would you describe the relationship between {self.name} and {other_agent_name} based on the following statements?
         \n- {joined_memory_statements}"""
 
-        relationship_summary = self.llm.get_llm_response(prompt)
+        relationship_summary = self.llm.get_llm_response(prompt, call_site="relationship_summary")
         return f"{relationship_summary}\nSentiment Score: {relationship_score}"
\ No newline at end of file
@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+
+# the index is only built once the tier holds this many embedding values (rows x dimension): exact scoring is a
+# single BLAS mat-vec, and probing only beats it from roughly 5M values on (about 3k rows of 1536-d ada-002
+# vectors, 15-20k rows of 256-d ones), so the default leaves some margin
+ANN_MIN_VALUES = int(os.environ.get("ANN_MIN_VALUES", 8_000_000))
+ANN_CANDIDATES = int(os.environ.get("ANN_CANDIDATES", 300))
+ANN_N_PROBE = int(os.environ.get("ANN_N_PROBE", 8))
+# compare the approximate ranking with the exact one every N long-term queries (0 = never)
+ANN_RECALL_CHECK_EVERY = int(os.environ.get("ANN_RECALL_CHECK_EVERY", 0))
+
+
+class IVFIndex:
+    """
+    Inverted-file index for cosine similarity, built in-process with NumPy.
+
+    Unit vectors are clustered with spherical k-means into about sqrt(n) lists. A query probes the lists
+    whose centroids are most similar until it has seen n_probe lists and at least n_candidates rows.
+    Rows added after training go to their nearest list; once the index has doubled in size since the
+    last training it asks to be retrained.
+    The index only stores row positions and centroids; the caller keeps the vectors.
+    """
+
+    def __init__(self, n_candidates=ANN_CANDIDATES, n_probe=ANN_N_PROBE, min_values=ANN_MIN_VALUES,
+                 n_iter=10, max_train_rows=20000, seed=0):
+        self.n_candidates = n_candidates
+        self.n_probe = n_probe
+        self.min_values = min_values
+        self.n_iter = n_iter
+        self.max_train_rows = max_train_rows
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        self.centroids = None
+        self.lists = []
+        self.n_rows = 0
+        self.n_trained = 0
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def needs_training(self, n_rows, dim):
+        if not self.is_trained:
+            return n_rows * dim >= self.min_values
+        return n_rows >= 2 * self.n_trained
+
+    def train_sample(self, n_rows):
+        """
+        Row positions to train on: all rows, or a random subset of max_train_rows of them.
+        """
+        if n_rows <= self.max_train_rows:
+            return np.arange(n_rows)
+        return np.sort(self.rng.choice(n_rows, self.max_train_rows, replace=False))
+
+    def train(self, vectors, n_rows):
+        """
+        Learns centroids from a sample of unit vectors and empties the lists; the caller re-adds all
+        n_rows rows with add().
+        """
+        n_lists = max(1, min(len(vectors), int(np.sqrt(n_rows))))
+        centroids = vectors[self.rng.choice(len(vectors), n_lists, replace=False)].astype(np.float32)
+
+        for _ in range(self.n_iter):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            norms = np.linalg.norm(sums, axis=1)
+            # empty clusters keep their previous centroid
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, np.newaxis]
+
+        self.centroids = centroids
+        self.lists = [[] for _ in range(n_lists)]
+        self.n_rows = 0
+        self.n_trained = n_rows
+
+    def add(self, positions, vectors):
+        if not len(positions):
+            return
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        for position, list_id in zip(positions.tolist(), assignment.tolist()):
+            self.lists[list_id].append(position)
+        self.n_rows += len(positions)
+
+    def probe(self, unit_query):
+        """
+        Row positions of the probed lists (unsorted, no duplicates).
+        """
+        order = np.argsort(-(self.centroids @ unit_query.astype(np.float32)))
+        probed = []
+        n_probed_rows = 0
+        for i, list_id in enumerate(order):
+            if i >= self.n_probe and n_probed_rows >= self.n_candidates:
+                break
+            probed.append(self.lists[list_id])
+            n_probed_rows += len(self.lists[list_id])
+        return np.fromiter((p for rows in probed for p in rows), dtype=np.int64, count=n_probed_rows)
@@ -1,8 +1,9 @@
+import asyncio
 import random
+import threading
 import time
 from datetime import timedelta
 from location import Location
-import time_utils  
 from memory import Memory 
 from time_utils import DatetimeNL
 
@@ -11,10 +12,30 @@ class Conversation:
     def __init__(self, agents):
         self.active_conversations = {}  
         self.agents = agents  
+        self.agents_by_name = {agent.name: agent for agent in agents}
         self.location = Location.get_instance()  
+        self.lock = threading.Lock()
+        self.talked_pairs = set()
+
+    def start_tick(self):
+        with self.lock:
+            self.talked_pairs.clear()
+
+    def claim_pair(self, agent, other_agent):
+        """
+        Atomically marks both agents as talking if both are idle and the pair has not talked this tick.
+        """
+        pair = frozenset((agent.name, other_agent.name))
+        with self.lock:
+            if agent.state != "idle" or other_agent.state != "idle" or pair in self.talked_pairs:
+                return False
+            agent.state = "talking"
+            other_agent.state = "talking"
+            self.talked_pairs.add(pair)
+            return True
 
     def conversation_trigger(self, agent):
-        curr_time = DatetimeNL.accelerated_time()
+        curr_time = DatetimeNL.now()
         last_activity = agent.plan.get_agent_action()
         
         if agent.state != "idle":
@@ -43,8 +64,9 @@ class Conversation:
         other_agent_name = random.choice(candidates)
         other_agent = self.get_agent_by_name(other_agent_name)
 
-        agent.state = "talking"
-        other_agent.state = "talking"
+        if not self.claim_pair(agent, other_agent):
+            agent.memory.add_to_memory("event", last_activity, timestamp=curr_time)
+            return f"{agent.name} could not start a conversation with {other_agent.name}."
 
         conversation_id = f"{agent.name}_{other_agent.name}_{int(time.time())}"
         self.active_conversations[conversation_id] = {
@@ -57,16 +79,22 @@ class Conversation:
 
 
     def run_conversation(self, conversation_id):
+        """
+        Runs the dialogue turn by turn. Utterances are streamed; from turn 6 on, the end-of-conversation check
+        on the dialogue so far runs while the next speaker is already generating, and that generation is
+        cancelled if the check says to stop.
+        """
         conversation = self.active_conversations[conversation_id]
         agent1, agent2 = conversation["agents"]
         turn = 0
-        start_time = time_utils.DatetimeNL.accelerated_time()
+        start_time = DatetimeNL.now()
+        end_check = None
 
         while turn < 10:
-            if time_utils.DatetimeNL.accelerated_time() - start_time >= timedelta(minutes=15):
+            if DatetimeNL.now() - start_time >= timedelta(minutes=15):
                 break
 
-            timestamp = time_utils.DatetimeNL.accelerated_time()
+            timestamp = DatetimeNL.now()
             speaker, listener = (agent1, agent2) if turn % 2 == 0 else (agent2, agent1)
             
             try:
@@ -79,18 +107,29 @@ class Conversation:
             else:
                 topic = conversation["dialogue"]
 
-            response = self.generate_response(speaker, listener, topic)
+            prompt = self.build_response_prompt(speaker, listener, topic)
+            generation = speaker.llm.submit(speaker.llm.astream_llm_response(prompt, call_site="conversation_turn"))
+            if end_check is not None and end_check.result():
+                generation.cancel()
+                end_check = None
+                break
+
+            response = generation.result()
             description = f"{speaker.name}: {response}"  
 
-            speaker.memory.add_to_memory(memory_type="chat", description=description, timestamp=timestamp)
-            listener.memory.add_to_memory(memory_type="chat", description=description, timestamp=timestamp)
+            Memory.add_to_memories([
+                (speaker.memory, "chat", description, timestamp),
+                (listener.memory, "chat", description, timestamp)
+            ])
 
             conversation["dialogue"].append(description)
             turn += 1
 
-            if turn > 5 and self.should_end_conversation(speaker, listener, turn):
-                break
+            if turn > 5:
+                end_check = speaker.llm.submit(self.ashould_end_conversation(speaker, listener, turn, list(conversation["dialogue"])))
 
+        if end_check is not None:
+            end_check.cancel()
         conversation["turns"] = turn
         print('conversation history:', conversation["dialogue"])
 
@@ -105,8 +144,10 @@ class Conversation:
         return f"Conversation ended after {turn} turns."
 
     def update_relationships_after_conversation(self, dialogue_text, agent1, agent2):
-        summary_agent1 = self.summarize_conversation(agent1, dialogue_text)
-        summary_agent2 = self.summarize_conversation(agent2, dialogue_text)
+        summary_agent1, summary_agent2 = agent1.llm.gather(
+            self.asummarize_conversation(agent1, dialogue_text),
+            self.asummarize_conversation(agent2, dialogue_text)
+        )
 
         agent1.update_relationship(agent2.name, summary_agent1)
         agent2.update_relationship(agent1.name, summary_agent2)
@@ -114,29 +155,38 @@ class Conversation:
         summary_with_relationship_1 = f"Summary (from {agent1.name}): {summary_agent1}"
         summary_with_relationship_2 = f"Summary (from {agent2.name}): {summary_agent2}"
 
-        agent1.memory.long_term_memory.add_reflection({
-            "node_id": agent1.memory.short_term_memory.generate_node_id("thought"),
-            "timestamp": time_utils.DatetimeNL.accelerated_time(),
-            "description": summary_with_relationship_1,
-            "memory_type": "thought",
-            "embedding": agent1.memory.short_term_memory.generate_embedding(summary_with_relationship_1),
-            "poignancy": agent1.memory.short_term_memory.calculate_poignancy(summary_with_relationship_1),
-            "emotion": agent1.memory.short_term_memory.emotion_analyze(summary_with_relationship_1)[0],
-            "emotion_intensity": agent1.memory.short_term_memory.emotion_analyze(summary_with_relationship_1)[1]
-        })
-
-        agent2.memory.long_term_memory.add_reflection({
-            "node_id": agent2.memory.short_term_memory.generate_node_id("thought"),
-            "timestamp": time_utils.DatetimeNL.accelerated_time(),
-            "description": summary_with_relationship_2,
-            "memory_type": "thought",
-            "embedding": agent2.memory.short_term_memory.generate_embedding(summary_with_relationship_2),
-            "poignancy": agent2.memory.short_term_memory.calculate_poignancy(summary_with_relationship_2),
-            "emotion": agent2.memory.short_term_memory.emotion_analyze(summary_with_relationship_2)[0],
-            "emotion_intensity": agent2.memory.short_term_memory.emotion_analyze(summary_with_relationship_2)[1]
-        })
+        annotation_1, annotation_2 = agent1.llm.gather(
+            self.aannotate_summary(agent1, summary_with_relationship_1),
+            self.aannotate_summary(agent2, summary_with_relationship_2)
+        )
+
+        for agent, summary, annotation in [(agent1, summary_with_relationship_1, annotation_1), (agent2, summary_with_relationship_2, annotation_2)]:
+            reflection_entry = {
+                "node_id": agent.memory.short_term_memory.generate_node_id("thought"),
+                "timestamp": DatetimeNL.now(),
+                "description": summary,
+                "memory_type": "thought",
+            }
+            reflection_entry.update(annotation)
+            agent.memory.long_term_memory.add_reflection(reflection_entry)
+
+    async def aannotate_summary(self, agent, summary):
+        short_term_memory = agent.memory.short_term_memory
+        embedding, (poignancy, emotion, emotion_intensity) = await asyncio.gather(
+            short_term_memory.agenerate_embedding(summary),
+            short_term_memory.ascore_memory(summary)
+        )
+        return {
+            "embedding": embedding,
+            "poignancy": poignancy,
+            "emotion": emotion,
+            "emotion_intensity": emotion_intensity
+        }
 
     def summarize_conversation(self, agent, conversation_text):
+        return agent.llm.run(self.asummarize_conversation(agent, conversation_text))
+
+    async def asummarize_conversation(self, agent, conversation_text):
         persona_info = agent.description 
 
         prompt = f"""
@@ -148,12 +198,12 @@ class Conversation:
 
         Summarize this from {agent.name}'s perspective in a casual way.
         """
-        return agent.llm.get_llm_response(prompt)
+        return await agent.llm.aget_llm_response(prompt, call_site="summary")
 
-    def should_end_conversation(self, speaker, listener, turn):
-        dialogue_history = self.active_conversations[f"{speaker.name}_{listener.name}_{turn}"]["dialogue"] \
-            if f"{speaker.name}_{listener.name}_{turn}" in self.active_conversations else []
+    def should_end_conversation(self, speaker, listener, turn, dialogue_history):
+        return speaker.llm.run(self.ashould_end_conversation(speaker, listener, turn, dialogue_history))
 
+    async def ashould_end_conversation(self, speaker, listener, turn, dialogue_history):
         prompt = f"""
         Below is the dialogue history between {speaker.name} and {listener.name} over {turn} turns:
 
@@ -164,7 +214,7 @@ class Conversation:
         If the dialogue feels stuck, repetitive, or lacks depth, say "yes" to end. Otherwise, say "no".
         Should this conversation naturally come to an end? (yes/no)
         """
-        response = speaker.llm.get_llm_response(prompt).strip().lower()
+        response = (await speaker.llm.aget_llm_response(prompt, call_site="conversation_end_check")).strip().lower()
         return response == "yes"
 
 
@@ -179,9 +229,12 @@ class Conversation:
 
         Suggest a topic they would naturally talk about.
         """
-        return speaker.llm.get_llm_response(prompt)
+        return speaker.llm.get_llm_response(prompt, call_site="conversation_topic")
 
     def generate_response(self, speaker, listener, topic):
+        return speaker.llm.get_llm_response(self.build_response_prompt(speaker, listener, topic), call_site="conversation_turn")
+
+    def build_response_prompt(self, speaker, listener, topic):
         persona_info = speaker.description
         topic_str = "\n".join(topic)
         
@@ -272,10 +325,7 @@ class Conversation:
             Generate a natural response in a conversational tone.
             Only two to three sentences.
             """
-        return speaker.llm.get_llm_response(prompt)
+        return prompt
 
     def get_agent_by_name(self, name):
-        for agent in self.agents:
-            if agent.name == name:
-                return agent
-        return None
+        return self.agents_by_name.get(name)
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "./cache/embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 50000))
+# keys per SELECT ... IN (...); older SQLite builds allow at most 999 bound parameters
+SQLITE_MAX_VARIABLES = 900
+
+
+class EmbeddingCache:
+    """
+    Process-wide embedding cache keyed by a hash of (model name, text).
+    - RAM tier: LRU bounded by max_entries.
+    - Disk tier: SQLite file, so repeated runs over the same persona files do not re-embed.
+      Vectors are stored as float64 blobs, so a cached embedding is bit-identical to the API response.
+    Set EMBEDDING_CACHE_PATH to an empty string to keep the cache in RAM only.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.connection = None
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, embedding BLOB)")
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def get_many(self, model, texts):
+        """
+        Cached embeddings for texts (None where missing); RAM misses are read from disk in one query per chunk.
+        Blocking: callers on the event loop run it in an executor.
+        """
+        keys = [self.make_key(model, text) for text in texts]
+        embeddings = [None] * len(keys)
+        with self.lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    embeddings[i] = self.entries[key]
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if self.connection is not None and missing:
+                missing_keys = list(missing)
+                for start in range(0, len(missing_keys), SQLITE_MAX_VARIABLES):
+                    chunk = missing_keys[start:start + SQLITE_MAX_VARIABLES]
+                    rows = self.connection.execute(
+                        f"SELECT key, embedding FROM embeddings WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        embedding = array("d", blob).tolist()
+                        self.remember(key, embedding)
+                        for i in missing.pop(key):
+                            embeddings[i] = embedding
+                            self.hits += 1
+                            self.disk_hits += 1
+
+            self.misses += sum(len(positions) for positions in missing.values())
+        return embeddings
+
+    def put(self, model, text, embedding):
+        self.put_many(model, [text], [embedding])
+
+    def put_many(self, model, texts, embeddings):
+        """
+        Stores a batch of embeddings with a single disk transaction. Blocking, like get_many.
+        """
+        rows = []
+        with self.lock:
+            for text, embedding in zip(texts, embeddings):
+                if embedding is None:
+                    continue
+                key = self.make_key(model, text)
+                self.remember(key, embedding)
+                rows.append((key, model, array("d", embedding).tobytes()))
+            if self.connection is not None and rows:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, embedding) VALUES (?, ?, ?)", rows
+                )
+                self.connection.commit()
+
+    def remember(self, key, embedding):
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "ram_entries": len(self.entries),
+            }
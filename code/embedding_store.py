@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+MEMORY_TIERS = ["short-term-memory", "long-term-memory"]
+
+
+def matrix_path_for(json_path):
+    root, _ = os.path.splitext(json_path)
+    return root + ".embeddings.npy"
+
+
+def split_embeddings(memory_data, matrix_path, dtype="float32"):
+    """
+    Moves node embeddings out of an agent's memory data into a binary matrix file (.npy) and
+    replaces them with an index: memory_data["embedding_matrix"] maps each tier to the node ids of its rows.
+    Rows are stored tier by tier, short-term first.
+    """
+    rows = []
+    node_ids = {}
+    for tier in MEMORY_TIERS:
+        node_ids[tier] = []
+        for node in memory_data.get(tier, []):
+            embedding = node.get("embedding")
+            if embedding is None:
+                continue
+            rows.append(np.asarray(embedding, dtype=dtype))
+            node_ids[tier].append(node["node_id"])
+            node["embedding"] = None
+
+    dim = len(rows[0]) if rows else 0
+    if any(len(row) != dim for row in rows):
+        raise ValueError("All embeddings must have the same dimension to be stored in one matrix")
+    matrix = np.stack(rows) if rows else np.zeros((0, dim), dtype=dtype)
+    np.save(matrix_path, matrix)
+
+    memory_data["embedding_matrix"] = {
+        "file": os.path.basename(matrix_path),
+        "dtype": dtype,
+        "node_ids": node_ids,
+    }
+    return memory_data
+
+
+def load_embeddings(memory_data, memory_path):
+    """
+    Memory-maps the matrix referenced by memory_data["embedding_matrix"] (if any) and sets each indexed
+    node's embedding to a zero-copy row view.
+    Returns {tier: (matrix, {node_id: row})} where matrix is a zero-copy view of that tier's rows;
+    tiers of files with inline embeddings map to (None, {}).
+    """
+    index = memory_data.get("embedding_matrix")
+    if not index:
+        return {tier: (None, {}) for tier in MEMORY_TIERS}
+
+    matrix_path = os.path.join(os.path.dirname(memory_path), index["file"])
+    matrix = np.load(matrix_path, mmap_mode="r")
+
+    tiers = {}
+    offset = 0
+    for tier in MEMORY_TIERS:
+        tier_ids = index["node_ids"].get(tier, [])
+        tier_matrix = matrix[offset:offset + len(tier_ids)]
+        rows = {node_id: i for i, node_id in enumerate(tier_ids)}
+        offset += len(tier_ids)
+
+        for node in memory_data.get(tier, []):
+            row = rows.get(node.get("node_id"))
+            if row is not None and node.get("embedding") is None:
+                node["embedding"] = tier_matrix[row]
+        tiers[tier] = (tier_matrix, rows)
+
+    return tiers
+
+
+def convert(json_path, output_path=None, dtype="float32"):
+    """
+    Converts an agent JSON file with inline embeddings into JSON + memory-mappable matrix file.
+    """
+    output_path = output_path or json_path
+    with open(json_path, "r", encoding="utf-8") as f:
+        memory_data = json.load(f)
+
+    matrix_path = matrix_path_for(output_path)
+    split_embeddings(memory_data, matrix_path, dtype=dtype)
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(memory_data, f, ensure_ascii=False, indent=4)
+
+    n_rows = sum(len(ids) for ids in memory_data["embedding_matrix"]["node_ids"].values())
+    print(f"Converted {json_path}: {n_rows} embeddings -> {matrix_path} ({dtype})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move agent memory embeddings into a memory-mapped matrix file")
+    parser.add_argument("json_path")
+    parser.add_argument("output_path", nargs="?", default=None)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    args = parser.parse_args()
+    convert(args.json_path, args.output_path, dtype=args.dtype)
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+from memory_node import MemoryNode
+
+JOURNAL_SUFFIX = ".journal.jsonl"
+EMBEDDING_SUFFIX = ".embeddings.f32"
+PERSONA_FIELDS = [
+    "name", "agent_type", "description", "intermediate_belief", "intermediate_belief_depression",
+    "history", "behavior", "situation", "auto_thought",
+]
+MEMORY_TIERS = {"short": "short-term-memory", "long": "long-term-memory"}
+
+
+def datetime_converter(o):
+    if isinstance(o, datetime):
+        return o.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, MemoryNode):
+        return o.to_dict()
+    raise TypeError(f"Type {type(o)} not serializable")
+
+
+def journal_paths(path):
+    """
+    Returns (journal_path, embedding_path) for a journal file or for a directory + agent name prefix.
+    """
+    if path.endswith(JOURNAL_SUFFIX):
+        path = path[:-len(JOURNAL_SUFFIX)]
+    return path + JOURNAL_SUFFIX, path + EMBEDDING_SUFFIX
+
+
+class AgentJournal:
+    """
+    Append-only persistence for one agent.
+    - <prefix>.journal.jsonl: one JSON record per saved turn holding only the memory nodes added since the
+      previous turn and the persona / relationship fields that changed.
+    - <prefix>.embeddings.f32: raw float32 embedding rows appended in the same order; nodes reference them
+      as {"offset": byte offset, "dim": length}.
+    The first record of a journal is a full snapshot; later records are deltas.
+    """
+
+    def __init__(self, path):
+        self.journal_path, self.embedding_path = journal_paths(path)
+        directory = os.path.dirname(self.journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.written = {tier: 0 for tier in MEMORY_TIERS}
+        self.last_fields = {}
+        self.turn = 0
+        self.needs_snapshot = True
+
+        if os.path.exists(self.journal_path):
+            # resume an existing journal: later turns only append deltas
+            state = load_journal(self.journal_path, with_embeddings=False)
+            self.turn = state["turn"] + 1
+            self.written = {tier: len(state[key]) for tier, key in MEMORY_TIERS.items()}
+            self.last_fields = self.agent_fields(state)
+            self.needs_snapshot = False
+
+    @staticmethod
+    def agent_fields(agent_or_state):
+        if isinstance(agent_or_state, dict):
+            fields = {field: agent_or_state.get(field) for field in PERSONA_FIELDS}
+            fields["relationships"] = dict(agent_or_state.get("relationships", {}))
+            fields["relationship_summary"] = dict(agent_or_state.get("relationship_summary", {}))
+            return fields
+
+        fields = {field: getattr(agent_or_state, field) for field in PERSONA_FIELDS}
+        fields["relationships"] = dict(agent_or_state.relationships)
+        fields["relationship_summary"] = dict(agent_or_state.relationship_summary)
+        return fields
+
+    def write_embedding(self, embedding_file, embedding):
+        if embedding is None:
+            return None
+        offset = embedding_file.tell()
+        row = np.asarray(embedding, dtype=np.float32)
+        embedding_file.write(row.tobytes())
+        return {"offset": offset, "dim": int(row.shape[0])}
+
+    def write_turn(self, agent, curr_time=None):
+        memories = {
+            "short": agent.memory.short_term_memory.whole_memories,
+            "long": agent.memory.long_term_memory.memory_entries,
+        }
+        return self.write_state(self.agent_fields(agent), memories, curr_time)
+
+    def write_state(self, fields, memories, curr_time=None):
+        record = {"turn": self.turn, "time": curr_time, "nodes": {}}
+
+        # a shrinking memory list cannot be expressed as a delta
+        if self.needs_snapshot or any(len(memories[tier]) < self.written[tier] for tier in MEMORY_TIERS):
+            self.written = {tier: 0 for tier in MEMORY_TIERS}
+            self.last_fields = {}
+            record["snapshot"] = True
+
+        changed = {key: value for key, value in fields.items() if self.last_fields.get(key) != value}
+        if changed:
+            record["fields"] = changed
+
+        with open(self.embedding_path, "ab") as embedding_file:
+            embedding_file.seek(0, os.SEEK_END)
+            for tier in MEMORY_TIERS:
+                new_nodes = []
+                for node in memories[tier][self.written[tier]:]:
+                    node = dict(node)
+                    node["embedding"] = self.write_embedding(embedding_file, node.get("embedding"))
+                    new_nodes.append(node)
+                if new_nodes:
+                    record["nodes"][tier] = new_nodes
+
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=datetime_converter, ensure_ascii=False) + "\n")
+
+        self.written = {tier: len(memories[tier]) for tier in MEMORY_TIERS}
+        self.last_fields = fields
+        self.needs_snapshot = False
+        self.turn += 1
+
+        n_nodes = sum(len(nodes) for nodes in record["nodes"].values())
+        print(f"Agent journaled! Turn: {record['turn']}, new nodes: {n_nodes}, changed fields: {list(changed)}")
+        return record
+
+
+def load_journal(path, turn=None, with_embeddings=True):
+    """
+    Rebuilds agent state by replaying the journal up to and including `turn` (default: last turn).
+    Returns a dict in the same shape as utils.save_agent_json writes, plus "relationships",
+    "relationship_summary" and "turn".
+    """
+    journal_path, embedding_path = journal_paths(path)
+
+    embeddings = None
+    if with_embeddings and os.path.exists(embedding_path) and os.path.getsize(embedding_path):
+        embeddings = np.memmap(embedding_path, dtype=np.float32, mode="r")
+
+    state = {field: None for field in PERSONA_FIELDS}
+    state.update({"relationships": {}, "relationship_summary": {}, "turn": -1})
+    for key in MEMORY_TIERS.values():
+        state[key] = []
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if turn is not None and record["turn"] > turn:
+                break
+
+            if record.get("snapshot"):
+                for key in MEMORY_TIERS.values():
+                    state[key] = []
+            state.update(record.get("fields", {}))
+
+            for tier, nodes in record["nodes"].items():
+                for node in nodes:
+                    reference = node.get("embedding")
+                    if reference is None or embeddings is None:
+                        node["embedding"] = None if with_embeddings else reference
+                    else:
+                        start = reference["offset"] // 4
+                        node["embedding"] = embeddings[start:start + reference["dim"]].tolist()
+                    state[MEMORY_TIERS[tier]].append(node)
+            state["turn"] = record["turn"]
+
+    return state
+
+
+def compact(path, turn=None):
+    """
+    Rewrites a journal as a single snapshot of the state at `turn` (default: last turn),
+    dropping later turns and unreferenced embedding rows.
+    """
+    journal_path, embedding_path = journal_paths(path)
+    state = load_journal(journal_path, turn=turn)
+
+    prefix = journal_path[:-len(JOURNAL_SUFFIX)]
+    tmp_prefix = prefix + ".compacting"
+    for tmp_path in journal_paths(tmp_prefix):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    journal = AgentJournal(tmp_prefix)
+    journal.turn = state["turn"]
+    memories = {tier: state[key] for tier, key in MEMORY_TIERS.items()}
+    journal.write_state(AgentJournal.agent_fields(state), memories)
+
+    os.replace(journal.embedding_path, embedding_path)
+    os.replace(journal.journal_path, journal_path)
+    print(f"Compacted {journal_path} at turn {state['turn']}")
+
+
+def export(path, output_path, turn=None):
+    """
+    Writes the state at `turn` as a regular agent JSON file that utils.create_agent can load.
+    """
+    state = load_journal(path, turn=turn)
+    state.pop("turn")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=4)
+    print(f"Exported {path} to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agent memory journal tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="rewrite a journal as a single snapshot")
+    compact_parser.add_argument("journal")
+    compact_parser.add_argument("--turn", type=int, default=None)
+
+    export_parser = subparsers.add_parser("export", help="write the state at a turn as agent JSON")
+    export_parser.add_argument("journal")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--turn", type=int, default=None)
+
+    args = parser.parse_args()
+    if args.command == "compact":
+        compact(args.journal, turn=args.turn)
+    else:
+        export(args.journal, args.output, turn=args.turn)
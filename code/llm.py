@@ -1,25 +1,313 @@
-import openai
-from openai import OpenAI
+import asyncio
+import os
+import random
+import threading
 import time
-from functools import cache
+from collections import deque
+from embedding_cache import EmbeddingCache
+from response_cache import ResponseCache
+from llm_backends import LLM_BACKEND, get_backend
+from profiler import Profiler
+
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", 16))
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 256))
+EMBEDDING_BATCH_WAIT = float(os.environ.get("EMBEDDING_BATCH_WAIT", 0.02))
+
+
+class EventLoopThread:
+    """
+    Process-wide asyncio loop running on a daemon thread.
+    Sync callers (agents run on a thread pool) submit coroutines to it and block on the result,
+    so every LLM request in the process shares one loop, one connection pool and one set of limits.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-event-loop", daemon=True)
+        self.thread.start()
+        self.semaphores = {}
+        self.batchers = {}
+
+    def run(self, coro):
+        if threading.current_thread() is self.thread:
+            coro.close()
+            raise RuntimeError("Blocking LLM call made from inside the LLM event loop; await the async method instead.")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def submit(self, coro):
+        """
+        Starts coro on the loop without waiting; returns a concurrent.futures.Future (cancel() cancels the coroutine).
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def semaphore(self, key, max_in_flight):
+        # only called from coroutines running on self.loop, so the semaphore binds to the right loop
+        if key not in self.semaphores:
+            self.semaphores[key] = asyncio.Semaphore(max_in_flight)
+        return self.semaphores[key]
+
+    def batcher(self, llm):
+        # only called from coroutines running on self.loop
+        key = (llm.backend.key, llm.api_key, llm.embedding_model_name)
+        if key not in self.batchers:
+            self.batchers[key] = EmbeddingBatcher(llm, self.loop)
+        return self.batchers[key]
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces embedding requests for one endpoint and model into list-input requests.
+    A batch is sent once it holds max_batch_size texts or max_wait seconds after its first text arrived.
+    Identical texts pending at the same time share one slot.
+    """
+
+    def __init__(self, llm, loop, max_batch_size=EMBEDDING_BATCH_SIZE, max_wait=EMBEDDING_BATCH_WAIT):
+        self.llm = llm
+        self.loop = loop
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = {}
+        self.flush_handle = None
+        self.batches_sent = 0
+        self.texts_sent = 0
+
+    def submit(self, text):
+        if text in self.pending:
+            return self.pending[text]
+
+        future = self.loop.create_future()
+        self.pending[text] = future
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.max_wait, self.flush)
+        return future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        asyncio.ensure_future(self.send(batch))
+
+    async def send(self, batch):
+        texts = list(batch)
+        self.batches_sent += 1
+        self.texts_sent += len(texts)
+        try:
+            embeddings = await self.llm.request_embeddings(texts)
+        except self.llm.backend.invalid_input_errors as e:
+            if len(texts) == 1:
+                self.fail(batch, e)
+                return
+            # one bad input should not fail the whole batch
+            for text in texts:
+                await self.send({text: batch[text]})
+            return
+        except Exception as e:
+            self.fail(batch, e)
+            return
+
+        for text, embedding in zip(texts, embeddings):
+            if not batch[text].done():
+                batch[text].set_result(embedding)
+        # request_embeddings checks the count, but a waiter left pending here would hang forever
+        if len(embeddings) < len(texts):
+            self.fail(batch, ValueError(f"Embedding batch of {len(texts)} texts returned {len(embeddings)} embeddings"))
+
+    @staticmethod
+    def fail(batch, error):
+        for future in batch.values():
+            if not future.done():
+                future.set_exception(error)
+
 
 class OpenAILLM:
-    def __init__(self, llm_model_name, embedding_model_name):
-        self.client = OpenAI(api_key="api-key")
-        self.llm_model_name = llm_model_name
-        self.embedding_model_name = embedding_model_name
-
-    def get_llm_response(self, prompt, max_tokens=1024, timeout=600):
-        n_retries = 10
-        for i in range(n_retries):
-            chat_completion = self.client.chat.completions.create(model=self.llm_model_name, messages=[{"role": "user", "content": prompt}], max_tokens=max_tokens, timeout=timeout)
-            return chat_completion.choices[0].message.content
-
-    @cache
-    def get_embeddings(self, query):
-        response = self.client.embeddings.create( 
-            input=query,
-            model=self.embedding_model_name
-        )
-        embeddings = response.data[0].embedding
-        return embeddings
\ No newline at end of file
+    """
+    LLM and embedding access for the simulation. Requests go to a backend from llm_backends (LLM_BACKEND:
+    "openai", "fake" or "local"); retries, concurrency limits, caches and embedding batching are shared by all.
+    """
+    def __init__(self, llm_model_name, embedding_model_name, api_key=None, base_url=None, max_in_flight=None,
+                 n_retries=10, backoff_base=1.0, backoff_max=60.0, backend=None, agent_name=None):
+        self.loop_thread = EventLoopThread.get_instance()
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY", "api-key")
+        self.base_url = base_url or os.environ.get("OPENAI_BASE_URL")
+        self.backend = get_backend(backend or LLM_BACKEND, self.api_key, self.base_url)
+        self.llm_model_name = self.backend.chat_model(llm_model_name)
+        self.embedding_model_name = self.backend.embedding_model(embedding_model_name)
+        self.max_in_flight = max_in_flight or LLM_MAX_IN_FLIGHT
+        self.n_retries = n_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.latencies = deque(maxlen=1000)
+        self.embedding_cache = EmbeddingCache.get_instance()
+        self.response_cache = ResponseCache.get_instance()
+        self.profiler = Profiler.get_instance()
+        # agent the calls are attributed to in the profile
+        self.agent_name = agent_name
+
+    def run(self, coro):
+        return self.loop_thread.run(coro)
+
+    def submit(self, coro):
+        return self.loop_thread.submit(coro)
+
+    def gather(self, *coros):
+        """
+        Runs independent coroutines concurrently and returns their results in order.
+        """
+        async def gather_all():
+            return await asyncio.gather(*coros)
+        return self.run(gather_all())
+
+    async def with_retries(self, kind, request, call_site=None, agent_name=None):
+        """
+        Runs request() (returning (result, usage)) with retries and records the call in the profiler under
+        call_site; the recorded time includes waiting for a slot and backing off between attempts.
+        """
+        semaphore = self.loop_thread.semaphore(self.backend.key, self.max_in_flight)
+        first_start = time.perf_counter()
+        for attempt in range(self.n_retries):
+            try:
+                async with semaphore:
+                    start = time.perf_counter()
+                    result, usage = await request()
+                end = time.perf_counter()
+                self.latencies.append((kind, end - start, attempt + 1))
+                self.profiler.record_llm(call_site or kind, agent_name, end - first_start, usage=usage, retries=attempt)
+                return result
+            except self.backend.retryable_errors as e:
+                if attempt == self.n_retries - 1:
+                    raise
+                delay = self.backoff_delay(attempt, e)
+                print(f"{kind} request failed ({type(e).__name__}), retry {attempt + 1}/{self.n_retries - 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def backoff_delay(self, attempt, error=None):
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def aget_llm_response(self, prompt, max_tokens=1024, timeout=600, temperature=None, cache=False, call_site=None):
+        """
+        cache=True answers repeated prompts from the response cache; only use it for calls whose answer
+        is a pure function of the prompt. Callers that reject a cached answer should aforget_response() it.
+        call_site names the caller in the profile.
+        """
+        if cache:
+            response = await self.response_cache_io(self.response_cache.get, self.llm_model_name, prompt, temperature)
+            if response is not None:
+                self.profiler.record_llm(call_site or "chat", self.agent_name, 0.0, cache_hits=1)
+                return response
+
+        async def request():
+            return await self.backend.complete(self.llm_model_name, prompt, max_tokens, timeout, temperature=temperature)
+        response = await self.with_retries("chat", request, call_site=call_site, agent_name=self.agent_name)
+        if cache:
+            await self.response_cache_io(self.response_cache.put, self.llm_model_name, prompt, response, temperature)
+        return response
+
+    async def astream_llm_response(self, prompt, max_tokens=1024, timeout=600, temperature=None, call_site=None):
+        """
+        Same as aget_llm_response, but reads the completion as a token stream. Cancelling the calling task
+        closes the stream, so a generation that is no longer needed stops consuming tokens.
+        """
+        async def request():
+            return await self.backend.stream(self.llm_model_name, prompt, max_tokens, timeout, temperature=temperature)
+        return await self.with_retries("chat_stream", request, call_site=call_site, agent_name=self.agent_name)
+
+    async def response_cache_io(self, function, *args):
+        """
+        Calls a ResponseCache method; with a disk tier it runs off the loop shared by every agent,
+        RAM-only lookups stay on it.
+        """
+        if self.response_cache.connection is None:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def aforget_response(self, prompt, temperature=None):
+        await self.response_cache_io(self.response_cache.discard, self.llm_model_name, prompt, temperature)
+
+    def forget_response(self, prompt, temperature=None):
+        self.response_cache.discard(self.llm_model_name, prompt, temperature)
+
+    async def aget_embeddings(self, query, call_site="embedding"):
+        return (await self.aembed_many([query], call_site=call_site))[0]
+
+    async def aembed_many(self, texts, call_site="embedding"):
+        """
+        Embeds a list of texts, answering from the embedding cache where possible and
+        coalescing the rest with other pending requests into batched list-input calls.
+        The profile gets one call_site entry per call; the batched requests are recorded as "embedding_batch".
+        """
+        start = time.perf_counter()
+        # cache reads may hit SQLite, so they run off the loop shared by every agent
+        loop = asyncio.get_running_loop()
+        embeddings = await loop.run_in_executor(None, self.embedding_cache.get_many, self.embedding_model_name, texts)
+        cache_hits = sum(embedding is not None for embedding in embeddings)
+        batcher = self.loop_thread.batcher(self)
+        missing = {i: batcher.submit(text) for i, text in enumerate(texts) if embeddings[i] is None}
+        if missing:
+            # shield: a cancelled caller must not cancel a future shared with other callers
+            results = await asyncio.gather(*[asyncio.shield(future) for future in missing.values()])
+            for i, embedding in zip(missing, results):
+                embeddings[i] = embedding
+        self.profiler.record_llm(call_site, self.agent_name, time.perf_counter() - start, cache_hits=cache_hits)
+        return embeddings
+
+    async def request_embeddings(self, texts):
+        async def request():
+            return await self.backend.embed(self.embedding_model_name, texts)
+        # batches mix texts from every agent, so they are not attributed to one
+        embeddings = await self.with_retries("embedding", request, call_site="embedding_batch")
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Embedding request for {len(texts)} texts returned {len(embeddings)} embeddings")
+        # one transaction per batch, written off the loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.embedding_cache.put_many, self.embedding_model_name, texts, embeddings)
+        return embeddings
+
+    def get_llm_response(self, prompt, max_tokens=1024, timeout=600, temperature=None, cache=False, call_site=None):
+        return self.run(self.aget_llm_response(prompt, max_tokens=max_tokens, timeout=timeout, temperature=temperature, cache=cache, call_site=call_site))
+
+    def get_embeddings(self, query, call_site="embedding"):
+        return self.run(self.aget_embeddings(query, call_site=call_site))
+
+    def embed_many(self, texts, call_site="embedding"):
+        return self.run(self.aembed_many(list(texts), call_site=call_site))
+
+    def latency_stats(self):
+        """
+        Summary of recent per-call latencies in seconds, grouped by request kind.
+        """
+        stats = {}
+        for kind in {entry[0] for entry in self.latencies}:
+            values = sorted(entry[1] for entry in self.latencies if entry[0] == kind)
+            stats[kind] = {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                "max": values[-1],
+            }
+        return stats
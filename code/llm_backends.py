@@ -0,0 +1,303 @@
+import ast
+import asyncio
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+import openai
+from openai import AsyncOpenAI
+
+# "openai": OpenAI-compatible endpoint, "fake": canned in-process answers, "local": sentence-transformers embeddings
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "openai")
+# chat backend behind "local" ("openai" also covers local OpenAI-compatible servers via OPENAI_BASE_URL)
+LOCAL_CHAT_BACKEND = os.environ.get("LOCAL_CHAT_BACKEND", "openai")
+LOCAL_EMBEDDING_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "fixed:<s>", "uniform:<low>:<high>" or "lognormal:<median>:<sigma>", in seconds
+FAKE_LLM_LATENCY = os.environ.get("FAKE_LLM_LATENCY", "fixed:0")
+FAKE_LLM_ERROR_RATE = float(os.environ.get("FAKE_LLM_ERROR_RATE", 0))
+FAKE_EMBEDDING_DIM = int(os.environ.get("FAKE_EMBEDDING_DIM", 1536))
+FAKE_LLM_SEED = int(os.environ.get("FAKE_LLM_SEED", 0))
+
+backends = {}
+backends_lock = threading.Lock()
+
+
+def get_backend(name, api_key=None, base_url=None):
+    """
+    Process-wide backend instance for name; OpenAI backends are shared per (api_key, base_url).
+    """
+    key = (name, api_key, base_url) if name == "openai" else (name,)
+    with backends_lock:
+        if key not in backends:
+            if name == "openai":
+                backends[key] = OpenAIBackend(api_key, base_url)
+            elif name == "fake":
+                backends[key] = FakeBackend()
+            elif name == "local":
+                backends[key] = None
+            else:
+                raise ValueError(f"Unknown LLM backend: {name}")
+    if name == "local" and backends[key] is None:
+        # created outside the lock: loading the model is slow and may build the chat backend
+        backend = LocalBackend(get_backend(LOCAL_CHAT_BACKEND, api_key, base_url))
+        with backends_lock:
+            if backends[key] is None:
+                backends[key] = backend
+    return backends[key]
+
+
+def usage_dict(usage):
+    if usage is None:
+        return None
+    return {"prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0, "completion_tokens": getattr(usage, "completion_tokens", 0) or 0}
+
+
+class LLMBackend:
+    """
+    Raw chat and embedding requests. OpenAILLM adds retries, concurrency limits, caching and batching on top,
+    so a backend only has to answer one request at a time.
+    Every request returns (result, usage), usage being {"prompt_tokens", "completion_tokens"} or None.
+    retryable_errors are retried by OpenAILLM; request_errors are every failure of the request itself
+    (retryable or not), as opposed to bugs in the caller; invalid_input_errors mean the input was rejected,
+    so a batch failing with one is retried text by text.
+    """
+    key = "base"
+    retryable_errors = ()
+    request_errors = ()
+    invalid_input_errors = ()
+
+    def chat_model(self, model):
+        """
+        Model name used for this backend's answers in the response cache.
+        """
+        return model
+
+    def embedding_model(self, model):
+        """
+        Model name used for this backend's vectors in the embedding cache.
+        """
+        return model
+
+    async def complete(self, model, prompt, max_tokens, timeout, temperature=None):
+        raise NotImplementedError
+
+    async def stream(self, model, prompt, max_tokens, timeout, temperature=None):
+        return await self.complete(model, prompt, max_tokens, timeout, temperature=temperature)
+
+    async def embed(self, model, texts):
+        raise NotImplementedError
+
+
+class OpenAIBackend(LLMBackend):
+    retryable_errors = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)
+    request_errors = (openai.APIError,)
+    invalid_input_errors = (openai.BadRequestError,)
+
+    def __init__(self, api_key, base_url):
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.key = f"openai:{base_url}"
+
+    async def complete(self, model, prompt, max_tokens, timeout, temperature=None):
+        options = {} if temperature is None else {"temperature": temperature}
+        chat_completion = await self.client.chat.completions.create(model=model, messages=[{"role": "user", "content": prompt}], max_tokens=max_tokens, timeout=timeout, **options)
+        return chat_completion.choices[0].message.content, usage_dict(chat_completion.usage)
+
+    async def stream(self, model, prompt, max_tokens, timeout, temperature=None):
+        options = {} if temperature is None else {"temperature": temperature}
+        stream = await self.client.chat.completions.create(model=model, messages=[{"role": "user", "content": prompt}], max_tokens=max_tokens, timeout=timeout, stream=True, stream_options={"include_usage": True}, **options)
+        parts = []
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                if getattr(chunk, "usage", None) is not None:
+                    usage = usage_dict(chunk.usage)
+        finally:
+            await stream.close()
+        return "".join(parts), usage
+
+    async def embed(self, model, texts):
+        response = await self.client.embeddings.create(input=texts, model=model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)], usage_dict(response.usage)
+
+
+class FakeBackendError(Exception):
+    pass
+
+
+class FakeBackend(LLMBackend):
+    """
+    In-process stand-in for the LLM, for load tests without network or API spend.
+
+    Answers are picked by recognising the simulation's own prompts and always pass their format checks
+    (scores, emotion JSON, plans covering the requested span and interval, a place from the offered options,
+    yes/no checks). Anything else gets a short generic sentence. Answers and embeddings are deterministic
+    functions of the prompt or text; latency is drawn from FAKE_LLM_LATENCY, and FAKE_LLM_ERROR_RATE of the
+    requests fail with a retryable error.
+    """
+    key = "fake"
+    retryable_errors = (FakeBackendError,)
+    request_errors = (FakeBackendError,)
+    EMOTIONS = ["joy", "sadness", "anger", "fear", "anticipation", "surprise", "trust", "disgust"]
+    TIME_PATTERN = r"(\d{1,2}):(\d{2})\s*(am|pm)"
+
+    def __init__(self, latency=FAKE_LLM_LATENCY, error_rate=FAKE_LLM_ERROR_RATE, embedding_dim=FAKE_EMBEDDING_DIM,
+                 seed=FAKE_LLM_SEED):
+        kind, *params = latency.split(":")
+        self.latency_kind = kind
+        self.latency_params = [float(param) for param in params]
+        self.error_rate = error_rate
+        self.embedding_dim = embedding_dim
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.rng_lock = threading.Lock()
+
+    def chat_model(self, model):
+        return f"fake:{model}"
+
+    def embedding_model(self, model):
+        return f"fake:{model}:{self.embedding_dim}"
+
+    def text_rng(self, text):
+        digest = hashlib.sha256(f"{self.seed}:{text}".encode("utf-8")).digest()
+        return np.random.default_rng(int.from_bytes(digest[:8], "little"))
+
+    def sample_latency(self):
+        with self.rng_lock:
+            if self.latency_kind == "uniform":
+                return self.rng.uniform(*self.latency_params)
+            if self.latency_kind == "lognormal":
+                median, sigma = self.latency_params
+                return median * float(np.exp(self.rng.normal(0, sigma)))
+        return self.latency_params[0] if self.latency_params else 0.0
+
+    async def wait(self):
+        with self.rng_lock:
+            fail = self.error_rate > 0 and self.rng.random() < self.error_rate
+        delay = self.sample_latency()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if fail:
+            raise FakeBackendError("fake backend error")
+
+    async def complete(self, model, prompt, max_tokens, timeout, temperature=None):
+        await self.wait()
+        response = self.answer(prompt)
+        # roughly four characters per token
+        return response, {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(response) // 4}
+
+    async def embed(self, model, texts):
+        await self.wait()
+        vectors = []
+        for text in texts:
+            vector = self.text_rng(text).normal(size=self.embedding_dim)
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors, {"prompt_tokens": sum(len(text) for text in texts) // 4, "completion_tokens": 0}
+
+    @staticmethod
+    def minute_to_time_nl(minute):
+        return f"{(minute // 60) % 12 or 12:02d}:{minute % 60:02d} {'am' if minute < 12 * 60 else 'pm'}"
+
+    @staticmethod
+    def activity_at(minute):
+        hour = minute // 60
+        if hour < 7 or hour >= 23:
+            return "sleeping in bed"
+        if hour < 9:
+            return "having breakfast in the kitchen"
+        if hour < 12:
+            return "walking in the park"
+        if hour < 13:
+            return "having lunch in the kitchen"
+        if hour < 16:
+            return "shopping at the market"
+        if hour < 18:
+            return "working in the garden"
+        if hour < 19:
+            return "cooking dinner in the kitchen"
+        return "watching tv in the living room"
+
+    def plan(self, start, end, step):
+        return "\n".join(f"{self.minute_to_time_nl(minute)}: {self.activity_at(minute)}" for minute in range(start, end + 1, step))
+
+    def answer(self, prompt):
+        rng = self.text_rng(prompt)
+        emotion = self.EMOTIONS[int(rng.integers(len(self.EMOTIONS)))]
+        score = int(rng.integers(1, 11))
+
+        if '"poignancy"' in prompt:
+            return f'{{"poignancy": {int(rng.integers(1, 11))}, "emotion": "{emotion}", "emotion_score": {score}}}'
+        if '"emotion_score"' in prompt:
+            return f'{{"emotion": "{emotion}", "emotion_score": {score}}}'
+        if "Provide Only Score" in prompt or "Return only the numeric score" in prompt:
+            return str(score)
+        if "select the most suitable location" in prompt:
+            options = re.search(r"\[.*\]", prompt.split("select the most suitable location", 1)[1])
+            if options:
+                places = ast.literal_eval(options.group(0))
+                return places[int(rng.integers(len(places)))]
+        if "(yes/no)" in prompt:
+            return "no"
+        if "respond with either yes or no" in prompt:
+            return "No."
+        if "Please plan a day" in prompt:
+            return self.plan(15, 23 * 60 + 45, 60)
+        if "Please decompose the plan" in prompt:
+            interval = re.search(r"intervals of (\d+)_?\s*(hour|minute)", prompt)
+            step = int(interval.group(1)) * (60 if interval.group(2) == "hour" else 1) if interval else 60
+            span = re.search(rf"start(?:s|ing) at {self.TIME_PATTERN} and end(?:s|ing) by {self.TIME_PATTERN}", prompt)
+            if span:
+                start = int(span.group(1)) % 12 * 60 + int(span.group(2)) + (12 * 60 if span.group(3) == "pm" else 0)
+                end = int(span.group(4)) % 12 * 60 + int(span.group(5)) + (12 * 60 if span.group(6) == "pm" else 0)
+                return self.plan(start, end, step)
+            return self.plan(15, 23 * 60 + 45, step)
+        if "Please use the suggested change" in prompt:
+            original_plan = prompt.split("original plan:", 1)[1].split("Stay with your Description", 1)[0]
+            return "\n".join(line.strip() for line in original_plan.split("\n") if line.strip())
+        if "high-level questions" in prompt:
+            return "1. What do they fear most?\n2. What do they hope for?\n3. What keeps them going?"
+        return f"I feel some {emotion} about how today is going."
+
+
+class LocalBackend(LLMBackend):
+    """
+    Embeds texts in-process with a sentence-transformers model; chat requests go to chat_backend.
+    Vectors have the local model's dimension, so stored embeddings from another model cannot be mixed in.
+    """
+
+    def __init__(self, chat_backend, model_name=LOCAL_EMBEDDING_MODEL, device=None):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("LLM_BACKEND=local needs the sentence-transformers package") from e
+        self.chat_backend = chat_backend
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device=device)
+        self.model_lock = threading.Lock()
+        self.key = f"local:{model_name}"
+        self.retryable_errors = chat_backend.retryable_errors
+        self.request_errors = chat_backend.request_errors
+        self.invalid_input_errors = chat_backend.invalid_input_errors
+
+    def chat_model(self, model):
+        return self.chat_backend.chat_model(model)
+
+    def embedding_model(self, model):
+        return f"local:{self.model_name}"
+
+    async def complete(self, model, prompt, max_tokens, timeout, temperature=None):
+        return await self.chat_backend.complete(model, prompt, max_tokens, timeout, temperature=temperature)
+
+    async def stream(self, model, prompt, max_tokens, timeout, temperature=None):
+        return await self.chat_backend.stream(model, prompt, max_tokens, timeout, temperature=temperature)
+
+    async def embed(self, model, texts):
+        # encoding is CPU/GPU bound, so it runs off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self.encode, texts), None
+
+    def encode(self, texts):
+        with self.model_lock:
+            return self.model.encode(list(texts), convert_to_numpy=True).tolist()
@@ -3,6 +3,7 @@ import networkx as nx
 import threading
 from typing import List
 from agent import Agent 
+from location_resolver import LOCATION_RESOLVER, LocationResolver
 
 class Location:
     _instance = None  
@@ -21,12 +22,19 @@ class Location:
         self.world_file = '../data/world_client_friend.yaml'
         self.graph = nx.Graph()
         self.agent_locations = {}
+        # place -> agents there; a dict keeps arrival order, so it is used as an ordered set
+        self.agents_at = {}
+        self.possible_locations = []
+        self.possible_location_set = frozenset()
+        self.aliases = {}
+        self.resolver = LocationResolver([])
         self.lock = threading.Lock()
         self.load_world()
 
     def load_world(self):
         with open(self.world_file, 'r', encoding='utf-8') as file:
             world_data = yaml.safe_load(file)
+        self.aliases = world_data.get("Aliases") or {}
         
         for location in world_data.get("World", []):
             if isinstance(location, dict): 
@@ -42,6 +50,9 @@ class Location:
                     self.graph.add_node(agent_name, type="agent")
                     self.graph.add_edge(agent_name, location)
                     self.agent_locations[agent_name] = location
+                    self.agents_at.setdefault(location, {})[agent_name] = None
+
+        self.refresh_possible_locations()
     
     def _add_sub_places(self, parent, sub_places):
         if isinstance(sub_places, list):
@@ -63,11 +74,28 @@ class Location:
             if agent.name in self.agent_locations:
                 old_location = self.agent_locations[agent.name]
                 self.graph.remove_edge(agent.name, old_location)
+                agents_there = self.agents_at.get(old_location, {})
+                agents_there.pop(agent.name, None)
+                if not agents_there:
+                    self.agents_at.pop(old_location, None)
             
             self.graph.add_edge(agent.name, new_location)
             self.agent_locations[agent.name] = new_location
-    
+            self.agents_at.setdefault(new_location, {})[agent.name] = None
+
+    def refresh_possible_locations(self):
+        """
+        Recomputes the leaf places from the graph. Call again after adding or removing places.
+        """
+        with self.lock:
+            self.possible_locations = self.compute_possible_locations()
+            self.possible_location_set = frozenset(self.possible_locations)
+            self.resolver = LocationResolver(self.possible_locations, self.aliases)
+
     def get_possible_locations(self) -> List[str]:
+        return list(self.possible_locations)
+
+    def compute_possible_locations(self) -> List[str]:
         possible_locations = []
 
         for node in self.graph.nodes:
@@ -89,6 +117,13 @@ class Location:
         
         if not possible_locations:
             return [current_location]
+
+        if LOCATION_RESOLVER == "rules":
+            resolved_location = self.resolver.resolve(agent.name, next_plan)
+            if resolved_location is not None:
+                self.resolver.count("local")
+                self.move_agent(agent, resolved_location)
+                return [resolved_location]
         
         attempts = 0
         chosen_location = current_location
@@ -103,12 +138,16 @@ class Location:
             
             Just select in option
             """
-            generated_location = str(agent.llm.get_llm_response(prompt)).strip()
+            generated_location = str(agent.llm.get_llm_response(prompt, call_site="location")).strip()
+            generated_location, snapped = self.resolver.snap(generated_location, self.possible_location_set)
             
-            if generated_location in possible_locations:
+            if generated_location is not None:
+                self.resolver.count("llm_snapped" if snapped else "llm")
                 chosen_location = generated_location
                 break
             attempts += 1
+        else:
+            self.resolver.count("llm_failed")
 
         self.move_agent(agent, chosen_location)
         return [chosen_location]
@@ -124,4 +163,8 @@ class Location:
         if not agent_location:
             return []
         
-        return [other_agent for other_agent, loc in self.agent_locations.items() if loc == agent_location and other_agent != agent.name]
+        return [other_agent for other_agent in self.get_agents_at(agent_location) if other_agent != agent.name]
+
+    def get_agents_at(self, place: str) -> List[str]:
+        with self.lock:
+            return list(self.agents_at.get(place, ()))
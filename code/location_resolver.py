@@ -0,0 +1,144 @@
+import difflib
+import os
+import re
+import threading
+
+# "rules": pick the place locally when the activity clearly names it, "llm": always ask the LLM
+LOCATION_RESOLVER = os.environ.get("LOCATION_RESOLVER", "rules")
+# keyword matches the best place needs, and how many more than the runner-up
+LOCATION_MIN_SCORE = int(os.environ.get("LOCATION_MIN_SCORE", 1))
+LOCATION_MIN_MARGIN = int(os.environ.get("LOCATION_MIN_MARGIN", 1))
+
+STOPWORDS = {"a", "an", "the", "and", "or", "to", "in", "at", "on", "of", "for", "with", "from", "by", "up",
+             "his", "her", "their", "my", "some", "while", "into", "out", "about", "around", "then", "s"}
+
+
+def stem(word):
+    """
+    Light suffix stripping so that the forms of a word used by aliases, plans and LLM answers meet:
+    dress/dresses/dressed -> dress, shop/shopping -> shop, store/stores -> stor, grocery/groceries -> groceri.
+    """
+    if len(word) > 4 and word.endswith("ies"):
+        word = word[:-3] + "i"
+    elif len(word) > 4 and word.endswith(("sses", "shes", "ches", "xes", "zes")):
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+
+    for suffix in ("ing", "ed"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            word = word[:-len(suffix)]
+            # shopp(ing) -> shop, but dress(ed) and call(ing) keep their double letter
+            if len(word) > 2 and word[-1] == word[-2] and word[-1] not in "lsz":
+                word = word[:-1]
+            break
+
+    if len(word) > 3 and word.endswith("e"):
+        word = word[:-1]
+    elif len(word) > 3 and word.endswith("y"):
+        word = word[:-1] + "i"
+    return word
+
+
+def tokenize(text):
+    words = re.findall(r"[a-z]+", str(text or "").lower().replace("'s", ""))
+    return {stem(word) for word in words if word not in STOPWORDS}
+
+
+class LocationResolver:
+    """
+    Picks an agent's next place from its current plan activity without the LLM when the choice is clear.
+
+    Every place is described by the words of its name plus the aliases of the world YAML's "Aliases" section,
+    whose keys match place names by substring (e.g. "Bedroom: [bed, sleep]" applies to every bedroom).
+    Places owned by someone else ("Zane's Kitchen") are only candidates when the activity mentions the owner.
+    The best place is taken when it matches at least LOCATION_MIN_SCORE activity words and beats the
+    runner-up by LOCATION_MIN_MARGIN; anything else is left to the LLM, whose answer is snapped onto the
+    closest place name, or else onto the place its words clearly point to.
+    """
+
+    def __init__(self, places, aliases=None):
+        self.places = list(places)
+        self.lock = threading.Lock()
+        self.counts = {"local": 0, "llm": 0, "llm_snapped": 0, "llm_failed": 0}
+        self.owners = {}
+        self.keywords = {}
+        for place in self.places:
+            match = re.match(r"^(.+?)'s\b", place)
+            owner = match.group(1).strip() if match else None
+            keywords = tokenize(place) - tokenize(owner)
+            for key, words in (aliases or {}).items():
+                if str(key).lower() in place.lower():
+                    keywords |= tokenize(" ".join(words or []))
+            self.owners[place] = owner
+            self.keywords[place] = keywords
+
+    def best_place(self, scores):
+        if not scores:
+            return None
+        scores.sort(reverse=True)
+        best_score, best_place = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0
+        if best_score < LOCATION_MIN_SCORE or best_score - runner_up < LOCATION_MIN_MARGIN:
+            return None
+        return best_place
+
+    def resolve(self, agent_name, activity):
+        """
+        The place for activity, or None if no place is a clear enough match.
+        """
+        activity_words = tokenize(activity)
+        if not activity_words:
+            return None
+
+        scores = []
+        for place in self.places:
+            owner = self.owners[place]
+            owner_words = tokenize(owner)
+            visiting = bool(owner_words) and owner_words <= activity_words
+            if owner is not None and owner != agent_name and not visiting:
+                continue
+            score = len(activity_words & self.keywords[place]) + (1 if visiting else 0)
+            scores.append((score, place))
+        return self.best_place(scores)
+
+    def snap(self, answer, possible_locations):
+        """
+        Maps an LLM answer onto one of possible_locations. Returns (place or None, snapped).
+        """
+        if answer in possible_locations:
+            return answer, False
+        cleaned = answer.strip().strip("\"'`[]().,:;*").strip()
+        by_lower = {place.lower(): place for place in possible_locations}
+        if cleaned.lower() in by_lower:
+            return by_lower[cleaned.lower()], True
+
+        contained = [place for place in possible_locations if place.lower() in cleaned.lower()]
+        if contained:
+            return max(contained, key=len), True
+
+        match = difflib.get_close_matches(cleaned.lower(), list(by_lower), n=1, cutoff=0.75)
+        if match:
+            return by_lower[match[0]], True
+
+        # an activity-like answer ("getting dressed at Zane's"): match its words against the place keywords
+        answer_words = tokenize(cleaned)
+        scores = []
+        for place in possible_locations:
+            owner_words = tokenize(self.owners.get(place))
+            keywords = self.keywords.get(place, tokenize(place))
+            score = len(answer_words & keywords) + (1 if owner_words and owner_words <= answer_words else 0)
+            scores.append((score, place))
+        place = self.best_place(scores) if answer_words else None
+        return (place, True) if place is not None else (None, False)
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+        total = sum(stats.values())
+        stats["local_fraction"] = stats["local"] / total if total else 0.0
+        return stats
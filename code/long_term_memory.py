@@ -1,36 +1,18 @@
-import json
-import os
+from memory_node import MemoryNode
+
 
 class LongTermMemory:
-    def __init__(self, memory_path):
-        self.memory_path = memory_path
+    def __init__(self, memory_store):
+        self.memory_store = memory_store
+        self.memory_path = memory_store.memory_path
         self.reflection_callback = None
         self.current_reflection = None
-
-        self.load_existing_data()
-
-        with open(memory_path, 'r', encoding='utf-8') as file:
-            memory_data = json.load(file)
-            self.memory_entries = memory_data.get("long-term-memory", [])
-
-            if isinstance(self.memory_entries, dict):
-                self.memory_entries = list(self.memory_entries.values())
-
-    def load_existing_data(self):
-        try:
-            if os.path.exists(self.memory_path):
-                with open(self.memory_path, "r", encoding="utf-8") as f:
-                    existing_data = json.load(f)
-                    self.memory_entries = existing_data.get("long-term-memory", [])
-            else:
-                self.memory_entries = []
-
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.memory_entries = []
-            print("No existing Long-Term Memory found. Initializing empty storage.")
+        self.memory_entries = memory_store.long_term_memories
 
     def add_reflection(self, reflection_entry):
+        reflection_entry = MemoryNode.from_dict(reflection_entry)
         self.memory_entries.append(reflection_entry)
+        self.memory_store.bump_version(reflection_entry["memory_type"])
         print(f"Reflection added! Current LongTermMemory count: {len(self.memory_entries)}")
         
         self.current_reflection = reflection_entry
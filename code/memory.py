@@ -1,17 +1,30 @@
 from short_term_memory import ShortTermMemory
 from long_term_memory import LongTermMemory
 from memory_retrieval import MemoryRetrieval
+from memory_store import MemoryStore
 
 class Memory:
-    def __init__(self, memory_path, persona=None):
-        self.short_term_memory = ShortTermMemory(memory_path, persona=persona)
-        self.long_term_memory = self.short_term_memory.long_term_memory
-        self.memory_retrieval = MemoryRetrieval(memory_path, persona=persona)
+    def __init__(self, memory_path, persona=None, memory_data=None):
+        self.memory_store = MemoryStore(memory_path, memory_data=memory_data)
+        self.long_term_memory = LongTermMemory(self.memory_store)
+        self.short_term_memory = ShortTermMemory(self.memory_store, long_term_memory=self.long_term_memory, persona=persona)
+        self.memory_retrieval = MemoryRetrieval(self.memory_store, self.short_term_memory, self.long_term_memory)
+        self.short_term_memory.embed_missing_memories()
 
 
     def add_to_memory(self, memory_type, description, timestamp):
         self.short_term_memory.add_to_memory(memory_type, description, timestamp)
 
+    @staticmethod
+    def add_to_memories(requests):
+        """
+        requests: [(memory, memory_type, description, timestamp), ...], annotated concurrently.
+        """
+        ShortTermMemory.add_to_memories([
+            (memory.short_term_memory, memory_type, description, timestamp)
+            for memory, memory_type, description, timestamp in requests
+        ])
+
     def retrieve_memories(self, query, top_n=5):
         return self.memory_retrieval.retrieve_top_memories(query)["top_10_retrieved"][:top_n]
     
@@ -27,6 +40,9 @@ class Memory:
     def add_reflection(self, reflection_entry):
         self.long_term_memory.add_reflection(reflection_entry)
 
+    def start_tick(self):
+        self.memory_retrieval.start_tick()
+
     def reset_chat_set(self):
         self.short_term_memory.reset_chat_set()
 
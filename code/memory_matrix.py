@@ -0,0 +1,356 @@
+import threading
+
+import numpy as np
+from memory_node import MemoryNode, memory_type_id, to_epoch_seconds
+
+MAX_RECENCY_HOURS = 168
+BASE_CHUNK_ROWS = 4096
+
+
+class MemoryMatrix:
+    """
+    Columnar view over a list of memory nodes used for batched retrieval scoring.
+
+    Embeddings, timestamps, poignancy, emotion intensity and emotion ids are kept in contiguous
+    NumPy arrays. Nodes appended to the underlying list are picked up incrementally on the next query.
+
+    base_embeddings / base_rows: optional memory-mapped embedding matrix of this tier and {node_id: row}
+    (see embedding_store.py). Nodes whose embedding is a row of it are scored straight from the mapped
+    file instead of being copied into RAM.
+
+    ann_index: optional IVFIndex (see ann_index.py), kept up to date as nodes are synced. When it is trained,
+    top-k queries only score the rows most relevant to the query (plus rows without an embedding).
+
+    Other agents' threads append to the node list while this one ranks (e.g. during a conversation), so
+    syncing and ranking hold self.lock and each sync only consumes the nodes it has actually read.
+    """
+
+    def __init__(self, nodes, memory_types=None, base_embeddings=None, base_rows=None, ann_index=None):
+        self.nodes = nodes
+        self.type_ids = {memory_type_id(memory_type) for memory_type in memory_types} if memory_types is not None else None
+        self.emotion_ids = {}
+        self.base_embeddings = base_embeddings
+        self.base_rows = base_rows or {}
+        self.base_norms = None
+        self.ann_index = ann_index
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.n_seen = 0
+        self.rows = []
+        self.base_row_list = []
+        self.embedding_list = []
+        self.timestamp_list = []
+        self.poignancy_list = []
+        self.emotion_score_list = []
+        self.emotion_list = []
+
+        self.embeddings = None
+        self.extra_positions = None
+        self.extra_index = None
+        self.base_row_of = None
+        self.base_positions = None
+        self.base_row_ids = None
+        self.has_embedding = None
+        self.timestamps = None
+        self.poignancy = None
+        self.emotion_score = None
+        self.emotion = None
+        self.dirty = True
+        self.n_indexed = 0
+        if self.ann_index is not None:
+            self.ann_index.reset()
+
+    def emotion_id(self, emotion):
+        if not emotion:
+            return -1
+        if emotion not in self.emotion_ids:
+            self.emotion_ids[emotion] = len(self.emotion_ids)
+        return self.emotion_ids[emotion]
+
+    def sync(self):
+        with self.lock:
+            if len(self.nodes) < self.n_seen:
+                self.reset()
+
+            new = self.nodes[self.n_seen:]
+            for node in new:
+                if not isinstance(node, MemoryNode):
+                    print("Unexpected node format:", node)
+                    continue
+                if self.type_ids is not None and node.type_id not in self.type_ids:
+                    continue
+
+                poignancy = node.poignancy
+                emotion_intensity = node.emotion_intensity
+
+                embedding = node.embedding
+                base_row = -1
+                if self.base_embeddings is not None and embedding is not None:
+                    base_row = self.base_rows.get(node.node_id, -1)
+
+                self.rows.append(node)
+                self.base_row_list.append(base_row)
+                self.embedding_list.append(embedding if base_row < 0 else None)
+                self.timestamp_list.append(node.epoch)
+                self.poignancy_list.append(poignancy / 10.0 if poignancy is not None else 0.0)
+                self.emotion_score_list.append(emotion_intensity / 10.0 if emotion_intensity is not None else 0.0)
+                self.emotion_list.append(self.emotion_id(node.emotion))
+                self.dirty = True
+
+            self.n_seen += len(new)
+
+            if self.dirty:
+                self.build_arrays()
+                self.update_index()
+
+    def build_arrays(self):
+        if self.base_embeddings is not None and len(self.base_embeddings):
+            dim = self.base_embeddings.shape[1]
+        else:
+            dim = next((len(e) for e in self.embedding_list if e is not None), 0)
+        n_rows = len(self.rows)
+
+        base_row_ids = np.asarray(self.base_row_list, dtype=np.int64)
+        self.base_positions = np.nonzero(base_row_ids >= 0)[0]
+        self.base_row_ids = base_row_ids[self.base_positions]
+        self.extra_positions = np.nonzero(base_row_ids < 0)[0]
+        self.base_row_of = base_row_ids
+        self.extra_index = np.full(n_rows, -1, dtype=np.int64)
+        self.extra_index[self.extra_positions] = np.arange(len(self.extra_positions))
+
+        embeddings = np.zeros((len(self.extra_positions), dim), dtype=np.float64)
+        has_embedding = base_row_ids >= 0
+        for i, position in enumerate(self.extra_positions):
+            embedding = self.embedding_list[position]
+            if embedding is not None and len(embedding) == dim:
+                embeddings[i] = embedding
+                has_embedding[position] = True
+
+        # same normalisation as sklearn's cosine_similarity
+        norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))
+        norms[norms == 0.0] = 1.0
+        self.embeddings = embeddings / norms[:, np.newaxis]
+        self.has_embedding = has_embedding
+        self.timestamps = np.asarray(self.timestamp_list, dtype=np.float64)
+        self.poignancy = np.asarray(self.poignancy_list, dtype=np.float64)
+        self.emotion_score = np.asarray(self.emotion_score_list, dtype=np.float64)
+        self.emotion = np.asarray(self.emotion_list, dtype=np.int64)
+        self.dirty = False
+
+    def update_index(self):
+        """
+        Adds rows synced since the last call to the ANN index, (re)training it first when it asks for it.
+        """
+        if self.ann_index is None:
+            return
+        n_rows = len(self.rows)
+        if self.ann_index.needs_training(n_rows, self.embeddings.shape[1]):
+            sample = self.ann_index.train_sample(n_rows)
+            sample = sample[self.has_embedding[sample]]
+            if not len(sample):
+                return
+            self.ann_index.train(self.unit_vectors(sample), n_rows)
+            self.n_indexed = 0
+        if not self.ann_index.is_trained:
+            return
+
+        for start in range(self.n_indexed, n_rows, BASE_CHUNK_ROWS):
+            positions = np.arange(start, min(start + BASE_CHUNK_ROWS, n_rows))
+            positions = positions[self.has_embedding[positions]]
+            self.ann_index.add(positions, self.unit_vectors(positions))
+        self.n_indexed = n_rows
+
+    def unit_vectors(self, positions):
+        """
+        float32 unit embeddings of the given rows, read from RAM or from the mapped base matrix.
+        """
+        vectors = np.zeros((len(positions), self.embeddings.shape[1]), dtype=np.float32)
+        extra = self.extra_index[positions]
+        in_ram = extra >= 0
+        vectors[in_ram] = self.embeddings[extra[in_ram]]
+        base = self.base_row_of[positions]
+        mapped = base >= 0
+        if mapped.any():
+            rows = np.asarray(self.base_embeddings[base[mapped]], dtype=np.float32)
+            vectors[mapped] = rows / self.get_base_norms()[base[mapped], np.newaxis]
+        return vectors
+
+    def get_base_norms(self):
+        if self.base_norms is None:
+            n_base = len(self.base_embeddings)
+            self.base_norms = np.empty(n_base, dtype=np.float64)
+            for start in range(0, n_base, BASE_CHUNK_ROWS):
+                chunk = np.asarray(self.base_embeddings[start:start + BASE_CHUNK_ROWS], dtype=np.float32)
+                self.base_norms[start:start + BASE_CHUNK_ROWS] = np.sqrt(np.einsum("ij,ij->i", chunk, chunk))
+            self.base_norms[self.base_norms == 0.0] = 1.0
+        return self.base_norms
+
+    def base_relevance(self, unit_query):
+        """
+        Cosine similarity of the unit query against every row of the memory-mapped base matrix,
+        computed chunk by chunk so the file is never copied into RAM as a whole.
+        """
+        n_base = len(self.base_embeddings)
+        query = unit_query.astype(np.float32)
+        relevance = np.empty(n_base, dtype=np.float64)
+        for start in range(0, n_base, BASE_CHUNK_ROWS):
+            chunk = np.asarray(self.base_embeddings[start:start + BASE_CHUNK_ROWS], dtype=np.float32)
+            relevance[start:start + BASE_CHUNK_ROWS] = chunk @ query
+        return relevance / self.get_base_norms()
+
+    def relevance_at(self, positions, unit_query):
+        """
+        Cosine similarity of the unit query against the given rows only; same arithmetic as the full pass.
+        """
+        relevance = np.zeros(len(positions), dtype=np.float64)
+        extra = self.extra_index[positions]
+        in_ram = extra >= 0
+        relevance[in_ram] = self.embeddings[extra[in_ram]] @ unit_query
+        base = self.base_row_of[positions]
+        mapped = base >= 0
+        if mapped.any():
+            rows = np.asarray(self.base_embeddings[base[mapped]], dtype=np.float32)
+            relevance[mapped] = (rows @ unit_query.astype(np.float32)) / self.get_base_norms()[base[mapped]]
+        return np.where(self.has_embedding[positions], relevance, 0.0)
+
+    def unit_query(self, query_embedding):
+        if self.embeddings.shape[1] != len(query_embedding):
+            return None
+        query = np.asarray(query_embedding, dtype=np.float64)
+        query_norm = np.sqrt(np.dot(query, query))
+        if query_norm == 0.0:
+            return None
+        return query / query_norm
+
+    def candidates(self, query_embedding):
+        """
+        Row positions worth scoring for this query, taken from the ANN index: the n_candidates most relevant
+        rows of the probed lists plus every row without an embedding.
+        Returns (sorted positions, lowest relevance among the nearest rows), or (None, None) when the index
+        is not in use, meaning every row should be scored.
+        """
+        self.sync()
+        if self.ann_index is None or not self.ann_index.is_trained or len(self.rows) <= self.ann_index.n_candidates:
+            return None, None
+        unit_query = self.unit_query(query_embedding)
+        if unit_query is None:
+            return None, None
+
+        probed = self.ann_index.probe(unit_query)
+        relevance = self.relevance_at(probed, unit_query)
+        nearest = self.top_k_indices(relevance, self.ann_index.n_candidates)
+        positions = np.union1d(probed[nearest], np.nonzero(~self.has_embedding)[0])
+        return positions, float(relevance[nearest].min())
+
+    def __len__(self):
+        with self.lock:
+            self.sync()
+            return len(self.rows)
+
+    def score(self, query_embedding, query_emotion, reference_time, weights, emotion_pairs, positions=None, with_relevance=True):
+        """
+        Computes the five weighted components for every row (or only the given row positions) in one pass.
+        Returns (total, recency, relevance, poignancy, emotion_score, emotion_relevance), all weighted.
+        with_relevance=False leaves relevance at 0, skipping the only part that touches the embeddings.
+        """
+        self.sync()
+        if positions is None:
+            positions = np.arange(len(self.rows))
+            all_rows = True
+        else:
+            all_rows = False
+        n_rows = len(positions)
+        emotion = self.emotion[positions]
+
+        time_diff = to_epoch_seconds(reference_time) - self.timestamps[positions]
+        recency = np.maximum(0, 1 - (np.abs(time_diff) / 3600) / MAX_RECENCY_HOURS)
+
+        relevance = np.zeros(n_rows, dtype=np.float64)
+        unit_query = self.unit_query(query_embedding) if n_rows and with_relevance else None
+        if unit_query is not None and not all_rows:
+            relevance = self.relevance_at(positions, unit_query)
+        elif unit_query is not None:
+            relevance[self.extra_positions] = self.embeddings @ unit_query
+            if len(self.base_positions):
+                relevance[self.base_positions] = self.base_relevance(unit_query)[self.base_row_ids]
+            relevance = np.where(self.has_embedding, relevance, 0.0)
+
+        emotion_relevance = np.full(n_rows, 0.5 / 1.5, dtype=np.float64)
+        paired_id = self.emotion_ids.get(emotion_pairs.get(query_emotion))
+        if paired_id is not None:
+            emotion_relevance[emotion == paired_id] = 0.1 / 1.5
+        query_id = self.emotion_ids.get(query_emotion)
+        if query_id is not None:
+            emotion_relevance[emotion == query_id] = 1.5 / 1.5
+        emotion_relevance[emotion == -1] = 0.0
+
+        weighted = (
+            weights['recency'] * recency,
+            weights['relevance'] * relevance,
+            weights['poignancy'] * self.poignancy[positions],
+            weights['emotion_score'] * self.emotion_score[positions],
+            weights['emotion_relevance'] * emotion_relevance,
+        )
+        total = weighted[0] + weighted[1] + weighted[2] + weighted[3] + weighted[4]
+        return (total,) + weighted
+
+    @staticmethod
+    def top_k_indices(scores, k=None):
+        """
+        Indices of the k highest scores, ordered like a stable descending sort (ties keep insertion order).
+        """
+        n_rows = len(scores)
+        if k is None or k >= n_rows:
+            return np.argsort(-scores, kind="stable")
+        if k <= 0:
+            return np.array([], dtype=np.int64)
+
+        partition = np.argpartition(-scores, k - 1)[:k]
+        threshold = scores[partition].min()
+        candidates = np.nonzero(scores >= threshold)[0]
+        order = np.lexsort((candidates, -scores[candidates]))
+        return candidates[order][:k]
+
+    def rank(self, query_embedding, query_emotion, reference_time, weights, emotion_pairs, top_k=None, exact=False):
+        """
+        Returns [(node, total, recency, relevance, poignancy, emotion_score, emotion_relevance), ...]
+        sorted by total score, the same shape MemoryRetrieval.rank_memory has always returned.
+        With an ANN index and a top_k, relevance is only computed for the index candidates unless exact=True.
+        Every other row is bounded by its remaining components plus the lowest candidate relevance and is
+        scored as well if that bound could still reach the top_k.
+        """
+        with self.lock:
+            positions = None
+            if top_k is not None and not exact:
+                positions, relevance_bound = self.candidates(query_embedding)
+            if positions is not None:
+                components = self.score(query_embedding, query_emotion, reference_time, weights, emotion_pairs, positions=positions)
+                if len(positions) >= top_k:
+                    kth_best = np.partition(components[0], len(positions) - top_k)[len(positions) - top_k]
+                    bound = self.score(query_embedding, query_emotion, reference_time, weights, emotion_pairs, with_relevance=False)[0]
+                    bound += weights['relevance'] * relevance_bound
+                    contenders = np.nonzero(bound >= kth_best)[0]
+                    if len(np.setdiff1d(contenders, positions, assume_unique=True)):
+                        positions = np.union1d(positions, contenders)
+                        components = self.score(query_embedding, query_emotion, reference_time, weights, emotion_pairs, positions=positions)
+            else:
+                components = self.score(query_embedding, query_emotion, reference_time, weights, emotion_pairs)
+            indices = self.top_k_indices(components[0], top_k)
+            rows = indices if positions is None else positions[indices]
+            return [
+                (self.rows[row],) + tuple(float(c[i]) for c in components)
+                for row, i in zip(rows, indices)
+            ]
+
+    def recall(self, query_embedding, query_emotion, reference_time, weights, emotion_pairs, top_k):
+        """
+        Fraction of the exact top_k that the approximate ranking also returns.
+        """
+        exact = self.rank(query_embedding, query_emotion, reference_time, weights, emotion_pairs, top_k=top_k, exact=True)
+        approximate = self.rank(query_embedding, query_emotion, reference_time, weights, emotion_pairs, top_k=top_k)
+        if not exact:
+            return 1.0
+        approximate_ids = {id(entry[0]) for entry in approximate}
+        return sum(id(entry[0]) in approximate_ids for entry in exact) / len(exact)
@@ -0,0 +1,137 @@
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+MEMORY_TYPES = ["event", "chat", "thought", "query", "day_plan", "15_minute_plan"]
+MEMORY_TYPE_IDS = {memory_type: i for i, memory_type in enumerate(MEMORY_TYPES)}
+memory_type_lock = threading.Lock()
+
+
+def to_epoch_seconds(timestamp):
+    """
+    Converts a node timestamp (datetime or "%Y-%m-%d %H:%M:%S" string) to naive epoch seconds.
+    Naive arithmetic keeps the result identical to subtracting the datetimes directly.
+    """
+    if isinstance(timestamp, str):
+        timestamp = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    return (timestamp - EPOCH).total_seconds()
+
+
+def memory_type_id(memory_type):
+    """
+    Small int for a memory type name; names not in MEMORY_TYPES are interned on first use.
+    """
+    type_id = MEMORY_TYPE_IDS.get(memory_type)
+    if type_id is None:
+        with memory_type_lock:
+            if memory_type not in MEMORY_TYPE_IDS:
+                MEMORY_TYPE_IDS[memory_type] = len(MEMORY_TYPES)
+                MEMORY_TYPES.append(memory_type)
+            type_id = MEMORY_TYPE_IDS[memory_type]
+    return type_id
+
+
+class MemoryNode:
+    """
+    One memory. The timestamp is kept as epoch seconds, the memory type as a small int and the embedding
+    as a float64 array (or a row of a memory-mapped matrix).
+
+    Nodes still behave like the dicts they replace (node["description"], node.get("embedding"), dict(node)),
+    so prompt building and persistence code is unchanged; node["timestamp"] is always a datetime.
+    The dict shape is only produced at the JSON boundary (to_dict()). Keys outside FIELDS are kept in extra.
+    """
+    __slots__ = ("node_id", "epoch", "description", "type_id", "embedding", "poignancy", "emotion",
+                 "emotion_intensity", "extra")
+    FIELDS = ("node_id", "timestamp", "description", "memory_type", "embedding", "poignancy", "emotion",
+              "emotion_intensity")
+
+    def __init__(self, node_id=None, timestamp=None, description=None, memory_type=None, embedding=None,
+                 poignancy=None, emotion=None, emotion_intensity=None, **extra):
+        self.node_id = node_id
+        self.timestamp = timestamp
+        self.description = description
+        self.memory_type = memory_type
+        self.set_embedding(embedding)
+        self.poignancy = poignancy
+        self.emotion = sys.intern(emotion) if isinstance(emotion, str) else emotion
+        self.emotion_intensity = emotion_intensity
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, node):
+        if isinstance(node, cls):
+            return node
+        return cls(**node)
+
+    @property
+    def timestamp(self):
+        if self.epoch is None:
+            return None
+        return EPOCH + timedelta(seconds=self.epoch)
+
+    @timestamp.setter
+    def timestamp(self, timestamp):
+        self.epoch = to_epoch_seconds(timestamp) if timestamp is not None else None
+
+    @property
+    def memory_type(self):
+        return MEMORY_TYPES[self.type_id] if self.type_id is not None else None
+
+    @memory_type.setter
+    def memory_type(self, memory_type):
+        self.type_id = memory_type_id(memory_type) if memory_type is not None else None
+
+    def set_embedding(self, embedding):
+        if embedding is not None and not isinstance(embedding, np.ndarray):
+            embedding = np.asarray(embedding, dtype=np.float64)
+        self.embedding = embedding
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == "embedding":
+            self.set_embedding(value)
+        elif key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in self.FIELDS or bool(self.extra and key in self.extra)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self.FIELDS) + list(self.extra or ())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """
+        The JSON shape of the node: timestamp as "%Y-%m-%d %H:%M:%S", embedding as a list.
+        """
+        node = dict(self.items())
+        if node["timestamp"] is not None:
+            node["timestamp"] = node["timestamp"].strftime(TIMESTAMP_FORMAT)
+        if node["embedding"] is not None:
+            node["embedding"] = node["embedding"].tolist()
+        return node
+
+    def __repr__(self):
+        return repr(self.to_dict())
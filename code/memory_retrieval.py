@@ -1,25 +1,82 @@
-import json
+import threading
 import numpy as np
+from collections import OrderedDict
 from datetime import datetime
 from sklearn.metrics.pairwise import cosine_similarity
-from short_term_memory import ShortTermMemory
-from long_term_memory import LongTermMemory
+from memory_matrix import MemoryMatrix
+from memory_node import MemoryNode
+from ann_index import IVFIndex, ANN_RECALL_CHECK_EVERY
+from structured_output import StructuredOutput, VALID_EMOTIONS, parse_emotion_response
 from llm import OpenAILLM
+from profiler import Profiler
 from time_utils import DatetimeNL
 
+RETRIEVAL_CACHE_MAX_ENTRIES = 256
+QUERY_EMOTION_CACHE_MAX_ENTRIES = 1024
+
 class MemoryRetrieval:
-    def __init__(self, memory_path, persona=None):
-        self.short_memory = ShortTermMemory(memory_path, persona=persona)
-        self.long_memory = LongTermMemory(memory_path)
+    def __init__(self, memory_store, short_memory, long_memory):
+        self.memory_store = memory_store
+        self.short_memory = short_memory
+        self.long_memory = long_memory
         self.short_term_data = self.short_memory.whole_memories
         self.long_term_data = self.long_memory.memory_entries
-        self.llm = OpenAILLM(llm_model_name="gpt-4o-mini", embedding_model_name="text-embedding-ada-002")
-
+        short_base, short_rows = memory_store.short_term_embeddings
+        long_base, long_rows = memory_store.long_term_embeddings
+        self.short_term_matrix = MemoryMatrix(self.short_term_data, memory_types=["event", "chat"], base_embeddings=short_base, base_rows=short_rows)
+        # long-term memory only grows, so it is the tier that gets an ANN index
+        self.long_term_matrix = MemoryMatrix(self.long_term_data, base_embeddings=long_base, base_rows=long_rows, ann_index=IVFIndex())
+        self.n_long_term_queries = 0
+        self.llm = OpenAILLM(llm_model_name="gpt-4o-mini", embedding_model_name="text-embedding-ada-002", agent_name=short_memory.name)
+        # (query, memory store version) -> retrieval result; cleared every tick since recency depends on the time
+        self.retrieval_cache = OrderedDict()
+        # (query, persona description) -> (emotion, emotion_score); the prompt includes the description,
+        # which reflections rewrite, but not the stored memories
+        self.query_emotions = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def start_tick(self):
+        with self.cache_lock:
+            self.retrieval_cache.clear()
 
     def retrieve_top_memories(self, query):
-        timestamp = DatetimeNL.accelerated_time()
+        """
+        Cached by query and memory store version: repeated queries return the same result until a memory
+        is added or the tick ends.
+        """
+        key = (query, self.memory_store.version)
+        with self.cache_lock:
+            result = self.retrieval_cache.get(key)
+            if result is not None:
+                self.retrieval_cache.move_to_end(key)
+                self.cache_hits += 1
+        if result is None:
+            result = self.rank_top_memories(query)
+            with self.cache_lock:
+                self.cache_misses += 1
+                self.retrieval_cache[key] = result
+                while len(self.retrieval_cache) > RETRIEVAL_CACHE_MAX_ENTRIES:
+                    self.retrieval_cache.popitem(last=False)
+        return {name: list(memories) for name, memories in result.items()}
+
+    def query_emotion(self, query):
+        key = (query, self.short_memory.format_persona())
+        with self.cache_lock:
+            if key in self.query_emotions:
+                self.query_emotions.move_to_end(key)
+                return self.query_emotions[key]
+        emotion = self.emotion_analyze(query)
+        with self.cache_lock:
+            self.query_emotions[key] = emotion
+            while len(self.query_emotions) > QUERY_EMOTION_CACHE_MAX_ENTRIES:
+                self.query_emotions.popitem(last=False)
+        return emotion
+
+    def rank_top_memories(self, query):
         query_embedding = self.generate_embedding(query)
-        query_emotion, query_emotion_score = self.emotion_analyze(query)
+        query_emotion, query_emotion_score = self.query_emotion(query)
 
         weights = {
             "recency": 0.10,
@@ -40,8 +97,9 @@ class MemoryRetrieval:
             "disgust": "surprise"
         }
 
-        short_ranked = self.rank_memory(query_embedding, query_emotion, self.short_term_data, weights, emotion_pairs, memory_type="short")
-        long_ranked = self.rank_memory(query_embedding, query_emotion, self.long_term_data, weights, emotion_pairs, memory_type="long")
+        with Profiler.get_instance().phase("retrieval_ranking", self.short_memory.name):
+            short_ranked = self.rank_memory(query_embedding, query_emotion, self.short_term_data, weights, emotion_pairs, memory_type="short", top_k=5)
+            long_ranked = self.rank_memory(query_embedding, query_emotion, self.long_term_data, weights, emotion_pairs, memory_type="long", top_k=5)
         short_top_5 = [node[0] for node in short_ranked[:5]]
         long_top_5 = [node[0] for node in long_ranked[:5]]
 
@@ -60,10 +118,12 @@ class MemoryRetrieval:
         return None 
 
     def generate_embedding(self, text):
-        return self.llm.get_embeddings(text)
+        return self.llm.get_embeddings(text, call_site="query_embedding")
 
     def calculate_recency(self, timestamp, reference_time):
-        time_diff = (reference_time - datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")).total_seconds()
+        if isinstance(timestamp, str):
+            timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+        time_diff = (reference_time - timestamp).total_seconds()
         time_diff_hours = abs(time_diff) / 3600
         max_time_diff = 168
         return max(0, 1 - (time_diff_hours / max_time_diff))
@@ -80,18 +140,35 @@ class MemoryRetrieval:
         else:
             return 0.5
 
-    def rank_memory(self, query_embedding, query_emotion, memory_data, weights, emotion_pairs, memory_type="short"):
-        reference_time = DatetimeNL.accelerated_time()
+    def rank_memory(self, query_embedding, query_emotion, memory_data, weights, emotion_pairs, memory_type="short", top_k=None, exact=False):
+        reference_time = DatetimeNL.now()
         print(reference_time)
+        matrix = self.get_memory_matrix(memory_data, memory_type)
+        if matrix is self.long_term_matrix and top_k is not None:
+            self.n_long_term_queries += 1
+            if ANN_RECALL_CHECK_EVERY and self.n_long_term_queries % ANN_RECALL_CHECK_EVERY == 0:
+                recall = matrix.recall(query_embedding, query_emotion, reference_time, weights, emotion_pairs, top_k)
+                print(f"ANN recall@{top_k} for long-term memory ({len(matrix)} nodes): {recall:.2f}")
+        return matrix.rank(query_embedding, query_emotion, reference_time, weights, emotion_pairs, top_k=top_k, exact=exact)
+
+    def get_memory_matrix(self, memory_data, memory_type="short"):
+        if memory_data is self.short_term_data and memory_type == "short":
+            return self.short_term_matrix
+        if memory_data is self.long_term_data and memory_type == "long":
+            return self.long_term_matrix
+        return MemoryMatrix(memory_data, memory_types=["event", "chat"] if memory_type == "short" else None)
+
+    def rank_memory_exact(self, query_embedding, query_emotion, memory_data, weights, emotion_pairs, memory_type="short"):
+        reference_time = DatetimeNL.now()
         scored_nodes = []
         for node in memory_data:
-            if not isinstance(node, dict):  
+            if not isinstance(node, MemoryNode):  
                 print("Unexpected node format:", node)
                 continue
-            if memory_type == "short" and node["memory_type"] not in ["event", "chat"]:
+            if memory_type == "short" and node.memory_type not in ["event", "chat"]:
                 continue
 
-            recency = self.calculate_recency(node['timestamp'], reference_time)
+            recency = self.calculate_recency(node.timestamp, reference_time)
             relevance = self.calculate_relevance(query_embedding, node['embedding'])
             poignancy = node.get('poignancy', 1) / 10.0 if node.get('poignancy') is not None else 0.0
             emotion_score = node.get('emotion_intensity', 1) / 10.0 if node.get('emotion_intensity') is not None else 0.0
@@ -112,15 +189,14 @@ class MemoryRetrieval:
 
         return scored_nodes
 
-    def emotion_analyze(self, query, max_attempts=50):
+    def emotion_analyze(self, query, max_attempts=None):
         persona_text = self.short_memory.format_persona() if self.short_memory else "Persona information not available."
-        valid_emotions = {"joy", "sadness", "anger", "fear", "anticipation", "surprise", "trust", "disgust"}
 
         prompt = f"""
         {persona_text}
 
         Analyze the following query and provide the primary emotion and its intensity.
-        1. The primary emotion must strictly be one of the following: {list(valid_emotions)}.
+        1. The primary emotion must strictly be one of the following: {VALID_EMOTIONS}.
         2. The intensity of the emotion should be a number between 1 and 10.
 
         Respond in JSON format only without explanation:
@@ -132,26 +208,11 @@ class MemoryRetrieval:
         Query: "{query}"
         """
 
-        for attempt in range(max_attempts):
-            response = self.llm.get_llm_response(prompt).strip()
-            response_clean = (
-                response.replace("```json", "")
-                .replace("```", "")
-                .strip()
-            )
-
-            try:
-                result = json.loads(response_clean)
-                emotion = result.get("emotion", "").strip().lower()
-                emotion_score = float(result.get("emotion_score", 5.0))
-
-                if emotion in valid_emotions:
-                    return emotion, emotion_score
-
-            except (json.JSONDecodeError, ValueError, TypeError) as e:
-                print()
+        result = StructuredOutput.get_instance().request(self.llm, prompt, parse_emotion_response, max_attempts=max_attempts, call_site="query_emotion")
+        if result is not None:
+            return result
 
-        print(f"⚠ Retrieval Warning: {max_attempts} attempts reached, setting default emotion to 'sadness'")
+        print(f"⚠ Retrieval Warning: no valid emotion for query {query!r}, setting default emotion to 'sadness'")
         return "sadness", 5.0
 
 
@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+import journal
+from embedding_store import load_embeddings
+from memory_node import MemoryNode
+
+
+class MemoryStore:
+    """
+    Single in-memory copy of an agent's memories.
+    The agent JSON is parsed once (by utils.create_agent, or here); ShortTermMemory, LongTermMemory and MemoryRetrieval
+    all hold views onto the same lists so that every component sees live state.
+    """
+
+    def __init__(self, memory_path, memory_data=None):
+        self.memory_path = memory_path
+        self.short_term_memories = []
+        self.long_term_memories = []
+        # memory-mapped embedding matrices (see embedding_store.py); (None, {}) for inline embeddings
+        self.short_term_embeddings = (None, {})
+        self.long_term_embeddings = (None, {})
+        # node ids are "<int>-<msg>"; the integer part comes from this allocator, seeded once at load
+        self.node_id_lock = threading.RLock()
+        self.next_node_id = 1
+        # bumped on every mutation of either tier; retrieval results are cached per version
+        self.version = 0
+        # memory_type -> nodes added since load, so "has a new chat/thought arrived" is an O(1) check
+        self.added_counts = {}
+        self.load(memory_data)
+
+    def read(self):
+        try:
+            if self.memory_path.endswith(journal.JOURNAL_SUFFIX):
+                return journal.load_journal(self.memory_path)
+            if os.path.exists(self.memory_path):
+                with open(self.memory_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            return {}
+        except json.JSONDecodeError:
+            print("No existing memory found. Initializing empty storage.")
+            return {}
+
+    def load(self, memory_data=None):
+        """
+        memory_data: the agent file as already parsed by the caller (see utils.create_agent); read from
+        memory_path when not given.
+        """
+        if memory_data is None:
+            memory_data = self.read()
+
+        memory_data["short-term-memory"] = self.as_list(memory_data.get("short-term-memory", []))
+        memory_data["long-term-memory"] = self.as_list(memory_data.get("long-term-memory", []))
+        embeddings = load_embeddings(memory_data, self.memory_path)
+        self.short_term_embeddings = embeddings["short-term-memory"]
+        self.long_term_embeddings = embeddings["long-term-memory"]
+
+        # nodes become typed records here and turn back into dicts only when written to JSON
+        self.short_term_memories[:] = [MemoryNode.from_dict(node) for node in memory_data["short-term-memory"]]
+        self.long_term_memories[:] = [MemoryNode.from_dict(node) for node in memory_data["long-term-memory"]]
+        self.seed_node_ids()
+        self.bump_version()
+
+    def seed_node_ids(self):
+        max_node_id = 0
+        for memory in self.short_term_memories + self.long_term_memories:
+            try:
+                max_node_id = max(max_node_id, int(memory["node_id"].split("-")[0]))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+        with self.node_id_lock:
+            self.next_node_id = max_node_id + 1
+
+    def bump_version(self, added_type=None):
+        with self.node_id_lock:
+            self.version += 1
+            if added_type is not None:
+                self.added_counts[added_type] = self.added_counts.get(added_type, 0) + 1
+            return self.version
+
+    def allocate_node_id(self):
+        with self.node_id_lock:
+            node_id = self.next_node_id
+            self.next_node_id += 1
+            return node_id
+
+    @staticmethod
+    def as_list(memories):
+        if isinstance(memories, dict):
+            return list(memories.values())
+        return list(memories)
@@ -44,7 +44,7 @@ class Persona:
         
         joined_memory_statements = "\n- ".join(memory_statements)
         prompt = f"""How would one describe {memory_query} given the following statements?\n- {joined_memory_statements}"""
-        return self.llm.get_llm_response(prompt)
+        return self.llm.get_llm_response(prompt, call_site="persona")
     
     def get_persona(self):
         core_characteristics = self.get_agent_information(aspect="core characteristics")
@@ -85,7 +85,7 @@ class Persona:
         
         joined_memory_statements = "\n- ".join(memory_statements)
         prompt = f"""How would one describe {memory_query} given the following statements?\n- Current Thought: {reflection} \n Past Memories: {joined_memory_statements} \n Previous_Persona: {self.description}"""
-        return self.llm.get_llm_response(prompt)
+        return self.llm.get_llm_response(prompt, call_site="persona")
     
     def get_persona_after_reflection(self, reflection):
         core_characteristics = self.get_agent_information_after_reflection(reflection, aspect="core characteristics")
@@ -135,7 +135,7 @@ class Persona:
                 Memories: {joined_memory_statements}
                 Question: {question}
                 Answer:"""
-        return self.llm.get_llm_response(prompt)
+        return self.llm.get_llm_response(prompt, call_site="persona")
 
     def test_persona(self):
         joined_memory_statements = """ Theodore: It sounds like you're acknowledging the weight of these feelings and considering a gentle start by taking a bit of time for self-reflection. How do you feel about making this space for yourself, even if it's a quiet, initial step?,
@@ -146,4 +146,4 @@ class Persona:
         """
        
         prompt = f"""How would one describe core characteristic given the following statements?\n- {joined_memory_statements}"""
-        return self.llm.get_llm_response(prompt)
\ No newline at end of file
+        return self.llm.get_llm_response(prompt, call_site="persona")
\ No newline at end of file
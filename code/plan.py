@@ -1,6 +1,19 @@
 import logging
+import os
 from time_utils import DatetimeNL
 from memory import Memory
+from plan_schedule import parse_plan_item
+
+# "segments": decompose the morning, afternoon and evening concurrently, "serial": the whole day per step
+PLAN_DECOMPOSITION = os.environ.get("PLAN_DECOMPOSITION", "segments")
+# (name, first minute of day, end minute of day)
+PLAN_SEGMENTS = [("morning", 0, 12 * 60), ("afternoon", 12 * 60, 18 * 60), ("evening", 18 * 60, 24 * 60)]
+DECOMPOSE_INTERVALS = ["1_hour", "30_minute", "15_minute"]
+# plan_update skips the LLM while its inputs are unchanged, but re-asks at least this often (game minutes, 0 = never skip)
+PLAN_UPDATE_MAX_STALE_MINUTES = float(os.environ.get("PLAN_UPDATE_MAX_STALE_MINUTES", 60))
+# new memories of these types count as a change for plan_update; "event" memories are left out because the
+# conversation step logs the agent's current plan activity as an event every tick
+PLAN_UPDATE_MEMORY_TYPES = ("chat", "thought")
 
 class Plan:
     def __init__(self, name, history, description, memory, auto_thought, situation, behavior, relationship, llm):
@@ -14,11 +27,14 @@ class Plan:
         self.situation = situation
         self.behavior = behavior
         self.relationship = relationship
+        self.plan_update_fingerprint = None
+        self.plan_update_checked_at = None
+        self.plan_update_counts = {"evaluated": 0, "skipped": 0}
 
     @staticmethod
     def check_updated_plan_format(plan):
         prev_t = None
-        curr_time = DatetimeNL.accelerated_time()
+        curr_time = DatetimeNL.now()
 
         if plan is None:
                 return False
@@ -63,6 +79,11 @@ class Plan:
 
         return True 
     
+    @staticmethod
+    def check_plan_item_format(plan_item):
+        plan_colon_split = plan_item.split(":")
+        return len(plan_colon_split) > 2 and plan_colon_split[0].isdigit() and len(plan_colon_split[1].split(" ")) == 2 and plan_colon_split[1].split(" ")[0].isdigit() and plan_colon_split[1].split(" ")[1] in ["am", "pm"]
+
     @staticmethod
     def check_plan_format(plan):
         if plan is None:
@@ -74,10 +95,7 @@ class Plan:
             return False 
 
         for plan_item in plan_items:
-            plan_colon_split = plan_item.split(":")
-            if len(plan_colon_split) > 2 and plan_colon_split[0].isdigit() and len(plan_colon_split[1].split(" ")) == 2 and plan_colon_split[1].split(" ")[0].isdigit() and plan_colon_split[1].split(" ")[1] in ["am", "pm"]:
-                pass
-            else:
+            if not Plan.check_plan_item_format(plan_item):
                 return False
             
         
@@ -160,7 +178,7 @@ class Plan:
         
         attempts = 0
         while not self.check_plan_format(resulting_plan) and attempts < max_attempts:
-            resulting_plan = self.llm.get_llm_response(prompt)
+            resulting_plan = self.llm.get_llm_response(prompt, call_site="day_plan")
             resulting_plan = self.postprocess_initial_plan(resulting_plan)
 
             attempts += 1
@@ -172,10 +190,9 @@ class Plan:
         self.memory.add_to_memory("day_plan", resulting_plan, timestamp=curr_time)
         return resulting_plan
 
-    def recursively_decompose_plan(self, plan, curr_time, time_interval="1 hour", max_attempts=10):
-
-        prompt = f"""
-            Please decompose the plan into items at intervals of {time_interval}. Generated plan must starts at 00:15am and ends by 11:45 pm.
+    def decompose_prompt(self, plan, time_interval, span="starts at 00:15am and ends by 11:45 pm"):
+        return f"""
+            Please decompose the plan into items at intervals of {time_interval}. Generated plan must {span}.
             You must consider {self.name}'s Description carefully to create his plan.
             Format: hh:mm am/pm: <activity>
 
@@ -239,11 +256,13 @@ class Plan:
 
             Return only plan.
             """
-        
+
+    def recursively_decompose_plan(self, plan, curr_time, time_interval="1 hour", max_attempts=10):
+        prompt = self.decompose_prompt(plan, time_interval)
         resulting_plan = None
         attempts = 0
         while not self.check_plan_format(resulting_plan) and attempts < max_attempts:
-            resulting_plan = self.llm.get_llm_response(prompt) 
+            resulting_plan = self.llm.get_llm_response(prompt, call_site="plan_decompose")
             resulting_plan = resulting_plan.split('\n')
             resulting_plan = '\n'.join([plan_item for plan_item in resulting_plan if plan_item.strip()])
 
@@ -257,31 +276,93 @@ class Plan:
             self.memory.add_to_memory(f"{time_interval}_plan", resulting_plan, curr_time )
         return resulting_plan
 
-    def get_plan_after_curr_time(self, curr_time, plan_type='15_minute'):
-        if plan_type == '15_minute':
-            retrieved_memories = self.memory.short_term_memory.retrieve_plan("15_minute_plan")
-            plan = retrieved_memories[-1]["description"] if retrieved_memories else ""
-        
-        time_nl = DatetimeNL.get_time_nl(curr_time)
+    @staticmethod
+    def minute_to_time_nl(minute):
+        return f"{(minute // 60) % 12 or 12:02d}:{minute % 60:02d} {'am' if minute < 12 * 60 else 'pm'}"
+
+    @staticmethod
+    def split_plan_into_segments(plan):
+        """
+        Splits a plan into the PLAN_SEGMENTS by item time, as [(segment plan, segment), ...]. Each segment starts
+        with the last item before it, since that activity is still going on when the segment begins.
+        Segments the plan has nothing for are left out.
+        """
+        items = []
+        for plan_item in plan.split('\n'):
+            minute, _ = parse_plan_item(plan_item)
+            if minute is not None:
+                items.append((minute, plan_item.strip()))
+        items.sort(key=lambda item: item[0])
+
+        segments = []
+        for name, start, end in PLAN_SEGMENTS:
+            before = [plan_item for minute, plan_item in items if minute < start][-1:]
+            inside = [plan_item for minute, plan_item in items if start <= minute < end]
+            if before or inside:
+                segments.append(('\n'.join(before + inside), (name, start, end)))
+        return segments
+
+    @staticmethod
+    def check_segment_format(plan, start, end):
+        if plan is None:
+            return False
+
         plan_items = plan.split('\n')
-        for i, plan_item in enumerate(plan_items):
-            if plan_item.strip().startswith(time_nl):
-                return '\n'.join(plan_items[i:])
+        if len(plan_items) < 2:
+            return False
 
-        date = DatetimeNL.get_date_nl(curr_time)
+        prev_minute = -1
+        for plan_item in plan_items:
+            minute, _ = parse_plan_item(plan_item)
+            if not Plan.check_plan_item_format(plan_item) or minute is None or not start <= minute < end or minute <= prev_minute:
+                return False
+            prev_minute = minute
+        return True
 
-        last_i_before_curr_time = None
-        for i, plan_item in enumerate(plan_items):
-            entry_time_nl = ":".join(plan_item.split(":")[:2])
-            if DatetimeNL.convert_nl_datetime_to_datetime(date, entry_time_nl) <= curr_time:
-                last_i_before_curr_time = i
-            else:
-                break
-            
-        if last_i_before_curr_time is not None:
-            return '\n'.join(plan_items[last_i_before_curr_time:])
-        
-        return ''
+    async def adecompose_segment(self, plan, segment, time_intervals, max_attempts=10):
+        """
+        Takes one segment of the day through every decomposition step; a malformed answer only retries this segment.
+        """
+        name, start, end = segment
+        span = f"cover only the {name}, starting at {self.minute_to_time_nl(max(start, 15))} and ending by {self.minute_to_time_nl(end - 15)}"
+        for time_interval in time_intervals:
+            prompt = self.decompose_prompt(plan, time_interval, span=span)
+            resulting_plan = None
+            attempts = 0
+            while not self.check_segment_format(resulting_plan, start, end) and attempts < max_attempts:
+                response = await self.llm.aget_llm_response(prompt, call_site="plan_decompose")
+                response = '\n'.join(self.remove_formatting_before_time(plan_item) for plan_item in response.split('\n'))
+                resulting_plan = self.postprocess_initial_plan(response)
+
+                attempts += 1
+                print(f"planning {name} {time_interval} attempt number {attempts} / {max_attempts}")
+
+            if not self.check_segment_format(resulting_plan, start, end):
+                raise ValueError(f"Plan {name} {time_interval} generation failed")
+            plan = resulting_plan
+        return plan
+
+    def decompose_plan_by_segments(self, plan, curr_time, time_intervals=DECOMPOSE_INTERVALS, max_attempts=20):
+        """
+        Same result as calling recursively_decompose_plan for each of time_intervals, but the day is split into
+        PLAN_SEGMENTS that are decomposed concurrently and stitched together at the end.
+        """
+        segments = self.split_plan_into_segments(plan)
+        if not segments:
+            raise ValueError("Plan has no items to decompose")
+        resulting_plan = '\n'.join(self.llm.gather(*[
+            self.adecompose_segment(segment_plan, segment, time_intervals, max_attempts=max_attempts)
+            for segment_plan, segment in segments
+        ]))
+        if not self.check_plan_format(resulting_plan):
+            raise ValueError(f"Plan {time_intervals[-1]} generation failed")
+
+        if time_intervals[-1] == "15_minute":
+            self.memory.add_to_memory("15_minute_plan", resulting_plan, curr_time)
+        return resulting_plan
+
+    def get_plan_after_curr_time(self, curr_time, plan_type='15_minute'):
+        return self.memory.short_term_memory.plan_schedule(f"{plan_type}_plan").remaining(curr_time)
         
     def change_plans_helper(self, suggested_change, existing_plan):
         prompt = f"""
@@ -315,7 +396,7 @@ class Plan:
             updated plan:
             """
     
-        llm_response = self.llm.get_llm_response(prompt)
+        llm_response = self.llm.get_llm_response(prompt, call_site="change_plans")
         plan = self.postprocess_change_plans_helper(llm_response)
         return plan
     
@@ -345,8 +426,39 @@ class Plan:
         return plan
 
     
+    def get_plan_update_fingerprint(self):
+        """
+        Everything plan_update's answer depends on besides the clock: the current plan, the description,
+        the relationship scores and how many chat and thought memories (in either tier) have been added.
+        """
+        short_term_memory = self.memory.short_term_memory
+        plan_entry = short_term_memory.latest_plan("15_minute_plan")
+        added_counts = short_term_memory.memory_store.added_counts
+        memory_counts = tuple(added_counts.get(memory_type, 0) for memory_type in PLAN_UPDATE_MEMORY_TYPES)
+        relationship = tuple(sorted(self.relationship.items())) if isinstance(self.relationship, dict) else str(self.relationship)
+        return (plan_entry["node_id"] if plan_entry is not None else None, self.description, relationship, memory_counts)
+
+    def should_skip_plan_update(self, curr_time):
+        if not PLAN_UPDATE_MAX_STALE_MINUTES or self.plan_update_checked_at is None:
+            return False
+        stale_minutes = (curr_time - self.plan_update_checked_at).total_seconds() / 60
+        return stale_minutes < PLAN_UPDATE_MAX_STALE_MINUTES and self.get_plan_update_fingerprint() == self.plan_update_fingerprint
+
     def plan_update(self):
-        curr_time = DatetimeNL.accelerated_time()
+        curr_time = DatetimeNL.now()
+        if self.should_skip_plan_update(curr_time):
+            self.plan_update_counts["skipped"] += 1
+            print(f"{self.name}: plan inputs unchanged, skipping plan update ({self.plan_update_counts})")
+            return None
+        self.plan_update_counts["evaluated"] += 1
+
+        updated_plan = self.evaluate_plan_update(curr_time)
+        # the fingerprint is taken after a possible replan, so the plan just stored does not trigger another check
+        self.plan_update_fingerprint = self.get_plan_update_fingerprint()
+        self.plan_update_checked_at = curr_time
+        return updated_plan
+
+    def evaluate_plan_update(self, curr_time):
         planned_activities = self.get_plan_after_curr_time(curr_time)
         formatted_date_time = DatetimeNL.get_formatted_date_time(curr_time)
         prompt = f"""
@@ -376,7 +488,7 @@ class Plan:
 
         Stay on your Background and Description.
         """
-        reaction_raw = self.llm.get_llm_response(prompt)
+        reaction_raw = self.llm.get_llm_response(prompt, call_site="plan_update")
         suggested_change = self.parse_reaction_response(reaction_raw)
         self.suggested_changes.append((suggested_change, curr_time))
 
@@ -404,22 +516,7 @@ class Plan:
             return ''
 
     def get_agent_action(self):
-            retrieved_memories = self.memory.short_term_memory.retrieve_plan("15_minute_plan")
-            plan = retrieved_memories[-1]["description"] if retrieved_memories else ""
-            plan = plan.lower()
-
-            curr_time = DatetimeNL.accelerated_time()
-            time_nl = DatetimeNL.get_time_nl(curr_time)
-            plan_items = plan.split('\n')
-
-            plan_items = [Plan.remove_formatting_before_time(plan_item) for plan_item in plan_items if Plan.remove_formatting_before_time(plan_item)]
-            date = DatetimeNL.accelerated_time()
-            
-            last_activity = None
-            for plan_item in plan_items:
-                entry_time_nl = ":".join(plan_item.split(":")[:2])
-                if DatetimeNL.convert_nl_datetime_to_datetime(date, entry_time_nl) <= curr_time:
-                    last_activity = ':'.join(plan_item.split(":")[2:])
+            last_activity = self.memory.short_term_memory.plan_schedule("15_minute_plan").current_activity(DatetimeNL.now())
             if last_activity is not None:
                 return last_activity
             return "N/A"
\ No newline at end of file
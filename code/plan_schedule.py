@@ -0,0 +1,60 @@
+import bisect
+import re
+
+PLAN_ITEM_PATTERN = re.compile(r"^\D*?(\d{1,2}):(\d{2})\s*(am|pm)\s*:(.*)$")
+
+
+def parse_plan_item(plan_item):
+    """
+    "hh:mm am/pm: <activity>" (any leading bullet or formatting is skipped) -> (minute of day, activity),
+    or (None, None) if the line is not a plan item. "12:xx am" and "00:xx am" are both just after midnight.
+    """
+    match = PLAN_ITEM_PATTERN.match(plan_item.lower())
+    if not match:
+        return None, None
+    hour, minute, ampm, activity = match.groups()
+    hour = int(hour) % 12 + (12 if ampm == "pm" else 0)
+    return hour * 60 + int(minute), activity
+
+
+class PlanSchedule:
+    """
+    A plan text parsed once into entries sorted by minute of day, so the current activity and the rest of
+    the plan are found by bisection instead of re-parsing every line on every tick.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan or ""
+        self.plan_items = self.plan.split('\n')
+        entries = []
+        for i, plan_item in enumerate(self.plan_items):
+            minute, activity = parse_plan_item(plan_item)
+            if minute is not None:
+                entries.append((minute, i, activity))
+        entries.sort()
+        self.minutes = [entry[0] for entry in entries]
+        self.item_index = [entry[1] for entry in entries]
+        self.activities = [entry[2] for entry in entries]
+
+    @staticmethod
+    def minute_of_day(curr_time):
+        return curr_time.hour * 60 + curr_time.minute
+
+    def current_activity(self, curr_time):
+        """
+        Activity of the latest item at or before curr_time (lowercased, as written after "hh:mm am:"), or None.
+        """
+        i = bisect.bisect_right(self.minutes, self.minute_of_day(curr_time)) - 1
+        return self.activities[i] if i >= 0 else None
+
+    def remaining(self, curr_time):
+        """
+        The plan text from the item scheduled exactly at curr_time, or else from the latest item before it.
+        """
+        minute = self.minute_of_day(curr_time)
+        i = bisect.bisect_left(self.minutes, minute)
+        if i == len(self.minutes) or self.minutes[i] != minute:
+            i = bisect.bisect_right(self.minutes, minute) - 1
+        if i < 0:
+            return ''
+        return '\n'.join(self.plan_items[self.item_index[i]:])
@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+PROFILE_ENABLED = os.environ.get("PROFILE", "1") != "0"
+# latencies kept per (kind, name) for the run summary percentiles
+PROFILE_MAX_SAMPLES = int(os.environ.get("PROFILE_MAX_SAMPLES", 10000))
+
+
+def new_row():
+    return {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "cache_hits": 0, "retries": 0,
+            "prompt_tokens": 0, "completion_tokens": 0}
+
+
+class Profiler:
+    """
+    Process-wide record of where a tick's time and tokens go.
+    - LLM calls are recorded by OpenAILLM, tagged with the caller's call_site and the agent owning the client.
+    - Local CPU work is timed with `with profiler.phase(name, agent_name):`.
+    end_tick() folds the tick's records into one row per (agent, kind, name), appends them to the JSONL file
+    given to start_run() and adds them to the run totals behind summary_table().
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, enabled=PROFILE_ENABLED, max_samples=PROFILE_MAX_SAMPLES):
+        self.enabled = enabled
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.path = None
+        self.tick = 0
+        self.tick_rows = defaultdict(new_row)
+        self.run_rows = defaultdict(new_row)
+        self.samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+
+    def start_run(self, path):
+        self.path = path
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def start_tick(self, tick):
+        with self.lock:
+            self.tick = tick
+            self.tick_rows = defaultdict(new_row)
+
+    def add(self, agent_name, kind, name, seconds, cache_hits=0, retries=0, prompt_tokens=0, completion_tokens=0):
+        if not self.enabled:
+            return
+        with self.lock:
+            row = self.tick_rows[(agent_name, kind, name)]
+            row["count"] += 1
+            row["seconds"] += seconds
+            row["max_seconds"] = max(row["max_seconds"], seconds)
+            row["cache_hits"] += cache_hits
+            row["retries"] += retries
+            row["prompt_tokens"] += prompt_tokens or 0
+            row["completion_tokens"] += completion_tokens or 0
+            self.samples[(kind, name)].append(seconds)
+
+    def record_llm(self, call_site, agent_name, seconds, usage=None, retries=0, cache_hits=0):
+        usage = usage or {}
+        self.add(agent_name, "llm", call_site, seconds, cache_hits=cache_hits, retries=retries,
+                 prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+
+    @contextmanager
+    def phase(self, name, agent_name=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(agent_name, "phase", name, time.perf_counter() - start)
+
+    def end_tick(self, game_time=None, wall_seconds=None):
+        """
+        Closes the tick: writes its rows (plus a "tick" row with the wall time) and adds them to the run totals.
+        """
+        if not self.enabled:
+            return []
+        with self.lock:
+            tick_rows, self.tick_rows = self.tick_rows, defaultdict(new_row)
+            if wall_seconds is not None:
+                tick_rows[(None, "tick", "wall")].update(count=1, seconds=wall_seconds, max_seconds=wall_seconds)
+                self.samples[("tick", "wall")].append(wall_seconds)
+            for (agent_name, kind, name), row in tick_rows.items():
+                run_row = self.run_rows[(kind, name)]
+                for key, value in row.items():
+                    run_row[key] = max(run_row[key], value) if key == "max_seconds" else run_row[key] + value
+
+        rows = [
+            dict(tick=self.tick, game_time=str(game_time) if game_time is not None else None, agent=agent_name, kind=kind, name=name, **row)
+            for (agent_name, kind, name), row in sorted(tick_rows.items(), key=lambda item: tuple(str(part) for part in item[0]))
+        ]
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as file:
+                for row in rows:
+                    file.write(json.dumps(row) + "\n")
+        return rows
+
+    def summary(self):
+        with self.lock:
+            summary = []
+            for (kind, name), row in sorted(self.run_rows.items(), key=lambda item: (item[0][0], -item[1]["seconds"])):
+                samples = sorted(self.samples[(kind, name)])
+                summary.append(dict(
+                    kind=kind, name=name, **row,
+                    mean_seconds=row["seconds"] / row["count"] if row["count"] else 0.0,
+                    p95_seconds=samples[min(len(samples) - 1, int(len(samples) * 0.95))] if samples else 0.0,
+                ))
+            return summary
+
+    def summary_table(self):
+        header = f"{'kind':<6} {'name':<24} {'count':>7} {'total s':>9} {'mean s':>8} {'p95 s':>8} {'max s':>8} {'cache':>6} {'retry':>6} {'tok in':>9} {'tok out':>8}"
+        lines = [header, "-" * len(header)]
+        for row in self.summary():
+            lines.append(
+                f"{row['kind']:<6} {str(row['name']):<24} {row['count']:>7} {row['seconds']:>9.2f} {row['mean_seconds']:>8.3f} "
+                f"{row['p95_seconds']:>8.3f} {row['max_seconds']:>8.3f} {row['cache_hits']:>6} {row['retries']:>6} "
+                f"{row['prompt_tokens']:>9} {row['completion_tokens']:>8}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# empty path keeps the cache in RAM only; set e.g. ./cache/response_cache.sqlite3 to reuse responses across runs
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 20000))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 24 * 3600))
+
+
+class ResponseCache:
+    """
+    Process-wide cache of chat completions keyed by a hash of (model, temperature, prompt).
+    Only meant for calls whose answer is a pure function of the prompt (poignancy and emotion scoring);
+    call sites opt in per request.
+    - RAM tier: LRU bounded by max_entries.
+    - Entries expire ttl seconds (wall time) after they were stored; ttl <= 0 disables expiry.
+    - Disk tier (optional): SQLite file at RESPONSE_CACHE_PATH.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.connection = None
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, created REAL, response TEXT)")
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(model, prompt, temperature=None):
+        return hashlib.sha256(f"{model}\0{temperature}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def is_expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def get(self, model, prompt, temperature=None):
+        key = self.make_key(model, prompt, temperature)
+        with self.lock:
+            if key in self.entries:
+                created, response = self.entries[key]
+                if not self.is_expired(created):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self.entries[key]
+                self.expired += 1
+
+            if self.connection is not None:
+                row = self.connection.execute("SELECT created, response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self.is_expired(row[0]):
+                    self.remember(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[1]
+
+            self.misses += 1
+            return None
+
+    def put(self, model, prompt, response, temperature=None):
+        if response is None:
+            return
+        key = self.make_key(model, prompt, temperature)
+        created = time.time()
+        with self.lock:
+            self.remember(key, created, response)
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, created, response) VALUES (?, ?, ?, ?)",
+                    (key, model, created, response)
+                )
+                self.connection.commit()
+
+    def discard(self, model, prompt, temperature=None):
+        """
+        Drops a cached response, e.g. one the caller could not parse, so a retry goes to the API.
+        """
+        key = self.make_key(model, prompt, temperature)
+        with self.lock:
+            self.entries.pop(key, None)
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+
+    def remember(self, key, created, response):
+        self.entries[key] = (created, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "ram_entries": len(self.entries),
+            }
@@ -0,0 +1,143 @@
+import concurrent.futures
+import os
+import time
+from datetime import datetime, timedelta
+
+import utils
+from journal import AgentJournal
+from conversation import Conversation
+from location import Location
+from plan import PLAN_DECOMPOSITION
+from profiler import Profiler
+from structured_output import StructuredOutput
+from time_utils import DatetimeNL
+
+
+class Scheduler:
+    """
+    Runs any number of agents tick by tick on a persistent worker pool.
+
+    Each tick is split into phases; every phase is a barrier, so all agents finish one phase before any
+    agent starts the next:
+    1. day rollover planning (only when the date changed) and choosing the next location; every agent's day
+       plan is built at this barrier, each split into segments that are decomposed concurrently
+    2. conversations and plan updates
+    3. saving agent state, either as an append-only journal per agent ("journal") or as a full JSON
+       snapshot per agent and turn ("snapshot")
+    The clock is advanced after the last phase.
+    LLM calls and timed CPU phases are written per tick and agent to profile_<run id>.jsonl in output_dir,
+    and a summary table is printed at the end of the run.
+    """
+
+    def __init__(self, agent_files, turns=200, max_workers=None, output_dir="./output", persistence="journal"):
+        self.agents = [utils.create_agent(file_name) for file_name in agent_files]
+        self.turns = turns
+        self.output_dir = output_dir
+        self.persistence = persistence
+        run_id = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        self.journals = {
+            agent.name: AgentJournal(os.path.join(output_dir, f"{agent.name}_{run_id}"))
+            for agent in self.agents
+        } if persistence == "journal" else {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or min(32, len(self.agents)))
+        self.location = Location.get_instance()
+        self.structured_output = StructuredOutput.get_instance()
+        self.profiler = Profiler.get_instance()
+        self.profiler.start_run(os.path.join(output_dir, f"profile_{run_id}.jsonl"))
+        self.tick_count = 0
+        self.conversation = Conversation(self.agents)
+        self.clock = DatetimeNL.get_clock()
+        self.game_time = DatetimeNL.now()
+        self.start_date = self.get_day(self.game_time)
+
+    @staticmethod
+    def get_day(curr_time):
+        return DatetimeNL.get_date_nl(curr_time).split(" ")[2]
+
+    def run_phase(self, step, *args):
+        """
+        Runs step(agent, *args) for every agent on the pool and waits for all of them.
+        If any agent failed, the first failure is re-raised once every agent has finished.
+        """
+        futures = {self.executor.submit(step, agent, *args): agent for agent in self.agents}
+        concurrent.futures.wait(futures)
+        errors = [(agent, future.exception()) for future, agent in futures.items() if future.exception() is not None]
+        for agent, error in errors:
+            print(f"Agent {agent.name} failed in {step.__name__}: {error!r}")
+        if errors:
+            raise errors[0][1]
+        return [future.result() for future in futures]
+
+    def plan_and_move(self, agent, curr_time, new_day):
+        print("")
+        print(f"Agent {agent.name} start: ", curr_time)
+
+        if new_day:
+            print("next day")
+            init_plan = agent.plan.initial_plan(curr_time, max_attempts=10)
+            if PLAN_DECOMPOSITION == "segments":
+                agent.plan.decompose_plan_by_segments(init_plan, curr_time, max_attempts=20)
+            else:
+                hourly_plan = agent.plan.recursively_decompose_plan(init_plan, curr_time, time_interval="1_hour", max_attempts=20)
+                half_plan = agent.plan.recursively_decompose_plan(hourly_plan, curr_time, time_interval="30_minute", max_attempts=20)
+                agent.plan.recursively_decompose_plan(half_plan, curr_time, time_interval="15_minute", max_attempts=20)
+
+        self.location.get_agent_next_location(agent, max_attempts=5)
+
+    def interact(self, agent):
+        self.conversation.conversation_trigger(agent)
+        agent.plan.plan_update()
+
+    def save(self, agent, curr_time):
+        if self.persistence == "journal":
+            with self.profiler.phase("save_journal", agent.name):
+                self.journals[agent.name].write_turn(agent, curr_time)
+            return
+        with self.profiler.phase("save_json", agent.name):
+            utils.save_agent_json(os.path.join(self.output_dir, f"{agent.name}_{curr_time.strftime('%Y-%m-%d_%H-%M-%S')}.json"), agent)
+
+    def tick(self):
+        tick_start = time.perf_counter()
+        self.profiler.start_tick(self.tick_count)
+        curr_time = DatetimeNL.now()
+        new_day = self.start_date != self.get_day(curr_time)
+        if new_day:
+            print(self.start_date, self.get_day(curr_time))
+
+        self.conversation.start_tick()
+        self.structured_output.start_tick()
+        for agent in self.agents:
+            agent.memory.start_tick()
+        self.run_phase(self.plan_and_move, curr_time, new_day)
+        self.run_phase(self.interact)
+        self.start_date = self.get_day(curr_time)
+
+        end = DatetimeNL.now()
+        elapsed_time = end - curr_time
+        print("Tick end: ", end, elapsed_time)
+        print("Structured output: ", self.structured_output.stats())
+        print("Location resolver: ", self.location.resolver.stats())
+        print("Plan updates: ", {key: sum(agent.plan.plan_update_counts[key] for agent in self.agents) for key in ("evaluated", "skipped")})
+
+        time_turn = timedelta(hours=0, minutes=15, seconds=0)
+        sleep_start = time.perf_counter()
+        if not self.clock.is_virtual and elapsed_time <= time_turn:
+            diff_sec = (time_turn - elapsed_time).total_seconds()
+            print("waiting for 15_min", diff_sec / self.clock.speed)
+            self.clock.sleep(diff_sec)
+        slept = time.perf_counter() - sleep_start
+
+        self.run_phase(self.save, DatetimeNL.now())
+        self.profiler.end_tick(curr_time, wall_seconds=time.perf_counter() - tick_start - slept)
+        self.tick_count += 1
+        self.game_time = self.clock.advance()
+
+    def run(self):
+        print("len ", len(self.agents))
+        try:
+            for i in range(self.turns):
+                self.tick()
+                print("Time: ", self.game_time, ", Turns: ", i)
+        finally:
+            self.executor.shutdown(wait=True)
+            print(self.profiler.summary_table())
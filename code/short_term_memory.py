@@ -1,86 +1,111 @@
 from llm import OpenAILLM
+import asyncio
 import json
-from datetime import datetime
 from long_term_memory import LongTermMemory
+from memory_node import MemoryNode
+from plan_schedule import PlanSchedule
+from time_utils import DatetimeNL
 import numpy as np
 import os
 import re
+from structured_output import StructuredOutput, VALID_EMOTIONS, parse_annotation_response, parse_emotion_response, parse_score
+
+# "split": separate poignancy and emotion prompts, "merged": one prompt returning both
+ANNOTATION_MODE = os.environ.get("MEMORY_ANNOTATION_MODE", "split")
 
 class ShortTermMemory:
-    def __init__(self, memory_path, reflection_threshold=150, persona=None, model="gpt-4o-mini"):
+    def __init__(self, memory_store, long_term_memory=None, reflection_threshold=150, persona=None, model="gpt-4o-mini", annotation_mode=None):
         self.chat_memories = []
         self.recent_memories = []
         self.current_poignancy = reflection_threshold
         self.current_emotion_score = reflection_threshold
         self.reflection_threshold = reflection_threshold
         self.chat_message_id = 0
-        self.general_memory_id = 1
+        self.chat_set_id = None
         self.persona = persona
         self.model = model
-        self.long_term_memory = LongTermMemory(memory_path)
-        self.llm = OpenAILLM(llm_model_name=self.model, embedding_model_name="text-embedding-ada-002")
-        self.memory_path = memory_path
+        self.memory_store = memory_store
+        self.long_term_memory = long_term_memory if long_term_memory is not None else LongTermMemory(memory_store)
+        self.llm = OpenAILLM(llm_model_name=self.model, embedding_model_name="text-embedding-ada-002", agent_name=persona.name if persona else None)
+        self.memory_path = memory_store.memory_path
         self.description = None
         self.name = self.persona.name
-
-        with open(memory_path, 'r', encoding='utf-8') as file:
-            memory = json.load(file)
-            self.whole_memories = memory["short-term-memory"]
-            if isinstance(self.whole_memories, dict):
-                self.whole_memories = list(self.whole_memories.values())
-
-        if self.whole_memories:
-            max_existing_node_id = max(
-                int(m["node_id"].split("-")[0]) for m in self.whole_memories if "node_id" in m
-            )
-            self.general_memory_id = max_existing_node_id + 1 
+        self.whole_memories = memory_store.short_term_memories
+        self.annotation_mode = annotation_mode or ANNOTATION_MODE
+        self.structured_output = StructuredOutput.get_instance()
+        # latest plan node per plan type, and its parsed schedule as (node, PlanSchedule)
+        self.latest_plans = {}
+        self.plan_schedules = {}
+        for memory_entry in self.whole_memories:
+            self.index_plan(memory_entry)
 
     def generate_node_id(self, memory_type):
         """
         Generates a unique node_id.
         - For "chat", use the same prefix (chat_set_id) and increase message_id.
         - For others (event, thought, etc.), use next available integer.
+        Integers come from the memory store's allocator, so this is O(1) and thread-safe.
         """
-        all_node_ids = []
-
-        # shortterm
-        all_node_ids += [int(m["node_id"].split("-")[0]) for m in self.whole_memories if "node_id" in m]
-
-        # longterm
-        all_node_ids += [int(m["node_id"].split("-")[0]) for m in self.long_term_memory.memory_entries if "node_id" in m]
-
-        max_existing_node_id = max(all_node_ids, default=0)
-
-        if memory_type == "chat":
-            if self.chat_message_id == 0:
-                self.chat_set_id = max_existing_node_id + 1
-            node_id = f"{self.chat_set_id}-{self.chat_message_id}"
-            self.chat_message_id += 1
-        else:
-            next_id = max_existing_node_id + 1
-            node_id = f"{next_id}-0"
-            self.general_memory_id = next_id + 1 
+        with self.memory_store.node_id_lock:
+            if memory_type == "chat":
+                if self.chat_message_id == 0:
+                    self.chat_set_id = self.memory_store.allocate_node_id()
+                node_id = f"{self.chat_set_id}-{self.chat_message_id}"
+                self.chat_message_id += 1
+            else:
+                node_id = f"{self.memory_store.allocate_node_id()}-0"
 
         print(f"generate_node_id(): generated node_id={node_id}")
         return node_id
 
     def reset_chat_set(self):
-        self.chat_message_id = 0
-        self.chat_set_id = None
+        with self.memory_store.node_id_lock:
+            self.chat_message_id = 0
+            self.chat_set_id = None
 
     def format_persona(self):
         return self.description
 
     def generate_embedding(self, description):
+        return self.llm.run(self.agenerate_embedding(description))
+
+    async def agenerate_embedding(self, description):
         try:
-            embedding = self.llm.get_embeddings(description)
+            embedding = await self.llm.aget_embeddings(description, call_site="memory_embedding")
             # print(f"Embedding generated.")
             return embedding
         except Exception as e:
             # print(f"Error generating embedding: {e}")
             return None
 
+    def generate_embeddings(self, descriptions):
+        try:
+            return self.llm.embed_many(descriptions, call_site="memory_embedding")
+        except Exception as e:
+            return [self.generate_embedding(description) for description in descriptions]
+
+    def embed_missing_memories(self):
+        """
+        Fills in embeddings for loaded memories that have none (e.g. seed histories) using batched requests.
+        """
+        missing = [
+            m for m in self.whole_memories + self.long_term_memory.memory_entries
+            if m.get("embedding") is None and m.get("description")
+            and m.get("memory_type") not in ["day_plan", "15_minute_plan"]
+        ]
+        if not missing:
+            return
+
+        embeddings = self.generate_embeddings([m["description"] for m in missing])
+        for m, embedding in zip(missing, embeddings):
+            m["embedding"] = embedding
+        self.memory_store.bump_version()
+        print(f"Embedded {len(missing)} memories without embeddings.")
+
     def calculate_poignancy(self, description):
+        return self.llm.run(self.acalculate_poignancy(description))
+
+    async def acalculate_poignancy(self, description):
         persona_text = self.format_persona()
         prompt = f"""
         You will be given the information of speaker and recent memory of speaker.
@@ -109,16 +134,14 @@ class ShortTermMemory:
         Provide Only Score, Nothing Else
 """
 
-        response = self.get_llm_response(prompt)
-        try:
-            poignancy = float(response.strip())
-            return poignancy
-        except ValueError:
-            return 5.0
+        poignancy = await self.structured_output.arequest(self.llm, prompt, lambda response: parse_score(response, default=None), call_site="poignancy")
+        return poignancy if poignancy is not None else 5.0
 
-    def emotion_analyze(self, description, max_attempts=100):
+    def emotion_analyze(self, description, max_attempts=None):
+        return self.llm.run(self.aemotion_analyze(description, max_attempts=max_attempts))
+
+    async def aemotion_analyze(self, description, max_attempts=None):
         persona_text = self.format_persona()
-        valid_emotions = {"joy", "sadness", "anger", "fear", "anticipation", "surprise", "trust", "disgust"}
         
         prompt = f"""
         {persona_text}
@@ -134,29 +157,19 @@ class ShortTermMemory:
         Memory: "{description}"
         """
 
-        attempts = 0
-        while attempts < max_attempts:
-            response = self.get_llm_response(prompt).strip()
-            try:
-                clean = re.sub(r"^```(?:json)?\s*|\s*```$", "", response.strip())
-                result = json.loads(clean)
-                emotion = result.get("emotion", "").strip().lower()
-                emotion_score = float(result.get("emotion_score", 5.0))
-
-                if emotion in valid_emotions:
-                    return emotion, emotion_score
-
-            except (json.JSONDecodeError, ValueError, TypeError):
-                pass  
+        result = await self.structured_output.arequest(self.llm, prompt, parse_emotion_response, max_attempts=max_attempts, call_site="emotion")
+        if result is not None:
+            return result
 
-            attempts += 1
-
-        print(f"⚠ short_term Warning: {max_attempts} attempts reached for description: {description!r} → setting default emotion to 'sadness'")
+        print(f"⚠ short_term Warning: no valid emotion for description: {description!r} → setting default emotion to 'sadness'")
         return "sadness", 5.0
 
-    def get_llm_response(self, prompt):
+    def get_llm_response(self, prompt, cache=False, call_site=None):
+        return self.llm.run(self.aget_llm_response(prompt, cache=cache, call_site=call_site))
+
+    async def aget_llm_response(self, prompt, cache=False, call_site=None):
         try:
-            return self.llm.get_llm_response(prompt)
+            return await self.llm.aget_llm_response(prompt, cache=cache, call_site=call_site)
         except Exception as e:
             return ""
 
@@ -175,73 +188,150 @@ class ShortTermMemory:
                 self.current_emotion_score = self.reflection_threshold
 
     def add_to_memory(self, memory_type, description, timestamp):
-        node_id = self.generate_node_id(memory_type)
+        ShortTermMemory.add_to_memories([(self, memory_type, description, timestamp)])
 
-        if memory_type in ["day_plan", "15_minute_plan"]:
+    @staticmethod
+    def add_to_memories(requests):
+        """
+        Adds one or more memories, possibly to different agents' ShortTermMemory.
+        requests: [(short_term_memory, memory_type, description, timestamp), ...]
+        - Node ids are assigned up front in request order.
+        - Embedding, poignancy and emotion requests of all memories are issued concurrently.
+        - Entries are stored, and reflection triggers checked, in request order.
+        """
+        if not requests:
+            return
+
+        node_ids = [short_term_memory.generate_node_id(memory_type) for short_term_memory, memory_type, _, _ in requests]
+        annotations = requests[0][0].llm.gather(*[
+            short_term_memory.annotate_memory(memory_type, description)
+            for short_term_memory, memory_type, description, _ in requests
+        ])
+
+        for (short_term_memory, memory_type, description, timestamp), node_id, annotation in zip(requests, node_ids, annotations):
             memory_entry = {
                 "node_id": node_id,
                 "timestamp": timestamp,
                 "description": description,
                 "memory_type": memory_type,
+            }
+            memory_entry.update(annotation)
+            short_term_memory.store_memory(memory_entry)
+
+    async def annotate_memory(self, memory_type, description):
+        if memory_type in ["day_plan", "15_minute_plan"]:
+            return {
+                "embedding": None,
                 "poignancy": None,
                 "emotion": None,
-                "emotion_intensity": None,
-                "embedding": None
+                "emotion_intensity": None
             }
-        elif memory_type == "thought" and description.strip().lower().startswith("summary"):
+
+        emotion_text, speaker = description, None
+        if memory_type == "thought" and description.strip().lower().startswith("summary"):
             pattern = r"Summary\s*\(from\s+([^)]+)\):\s*(.*)"
             match = re.match(pattern, description, re.IGNORECASE)
             if match:
                 speaker = match.group(1).strip()
-                summary_text = match.group(2).strip()
+                emotion_text = match.group(2).strip()
             else:
                 speaker = ""
-                summary_text = description.split(":", 1)[1].strip() if ":" in description else description
+                emotion_text = description.split(":", 1)[1].strip() if ":" in description else description
+        elif memory_type == "chat":
+            speaker, emotion_text = self.extract_speaker_and_content(description)
 
-            embedding = self.generate_embedding(description)
-            poignancy = self.calculate_poignancy(description)
-            if self.persona and speaker == self.persona.name:
-                emotion, emotion_intensity = self.emotion_analyze(summary_text)
-            else:
-                emotion, emotion_intensity = self.emotion_analyze_as_listener(summary_text, speaker)
-            memory_entry = {
-                "node_id": node_id,
-                "timestamp": timestamp,
-                "description": description,
-                "memory_type": memory_type,
-                "embedding": embedding,
-                "poignancy": poignancy,
-                "emotion": emotion,
-                "emotion_intensity": emotion_intensity
-            }
+        if self.persona and speaker == self.persona.name:
+            speaker = None
+
+        embedding, (poignancy, emotion, emotion_intensity) = await asyncio.gather(
+            self.agenerate_embedding(description),
+            self.ascore_memory(description, emotion_text, speaker)
+        )
+        return {
+            "embedding": embedding,
+            "poignancy": poignancy,
+            "emotion": emotion,
+            "emotion_intensity": emotion_intensity
+        }
+
+    def score_memory(self, description, emotion_text=None, speaker=None):
+        return self.llm.run(self.ascore_memory(description, emotion_text, speaker))
+
+    async def ascore_memory(self, description, emotion_text=None, speaker=None):
+        """
+        Returns (poignancy, emotion, emotion_intensity) of a memory.
+        emotion_text: part of the description the emotion is judged on (defaults to the description).
+        speaker: set when the memory is something another agent said, so the emotion is judged as a listener.
+        """
+        emotion_text = description if emotion_text is None else emotion_text
+        if self.annotation_mode == "merged":
+            return await self.aannotate_merged(description, emotion_text, speaker)
+
+        if speaker is None:
+            emotion_request = self.aemotion_analyze(emotion_text)
         else:
-            embedding = self.generate_embedding(description)
-            poignancy = self.calculate_poignancy(description)
+            emotion_request = self.aemotion_analyze_as_listener(emotion_text, speaker)
+        poignancy, (emotion, emotion_intensity) = await asyncio.gather(
+            self.acalculate_poignancy(description),
+            emotion_request
+        )
+        return poignancy, emotion, emotion_intensity
 
-            if memory_type == "chat":
-                speaker, content = self.extract_speaker_and_content(description)
-                if self.persona and speaker == self.persona.name:
-                    emotion, emotion_intensity = self.emotion_analyze(content)
-                else:
-                    emotion, emotion_intensity = self.emotion_analyze_as_listener(content, speaker)
-            else:
-                emotion, emotion_intensity = self.emotion_analyze(description)
+    async def aannotate_merged(self, description, emotion_text, speaker=None, max_attempts=None):
+        """
+        Asks for poignancy, emotion and intensity in one JSON response.
+        Answers that are only slightly off (code fences, text around the JSON, numbers as strings,
+        out-of-range scores, synonym emotions) are repaired locally; the prompt is only re-sent
+        when no valid emotion can be recovered.
+        """
+        persona_text = self.format_persona()
+        if speaker is None:
+            emotion_task = "The primary emotion the speaker feels about this memory"
+        else:
+            emotion_task = f'The primary emotion the speaker feels as a listener to what {speaker} said: "{emotion_text}"'
 
-            memory_entry = {
-                "node_id": node_id,
-                "timestamp": timestamp,
-                "description": description,
-                "memory_type": memory_type,
-                "embedding": embedding,
-                "poignancy": poignancy,
-                "emotion": emotion,
-                "emotion_intensity": emotion_intensity
-            }
+        prompt = f"""
+        You will be given the information of speaker and recent memory of speaker.
+
+        Speaker information: 
+        {persona_text}
 
+        Recent_Memory:
+        {description}
+
+        Provide:
+        1. "poignancy": the importance of the memory to the speaker's psychological growth or self-understanding, from 1.0 to 10.0.
+           1 is a memory with little to no impact (routine tasks, factual statements, minor observations),
+           5 is a moment of moderate emotional awareness or insight,
+           10 is a rare and highly impactful memory that significantly alters the speaker's thinking, emotions, or behavior.
+           Penalize routine tasks or memories that lack emotional depth; give extra points to memories that open up
+           self-reflection or small actionable steps without feeling overwhelming.
+        2. "emotion": {emotion_task}. It must strictly be one of the following: {json.dumps(VALID_EMOTIONS)}.
+        3. "emotion_score": the intensity of that emotion, a number between 1 and 10.
+
+        Respond in JSON format only, like this:
+        {{
+            "poignancy": 3,
+            "emotion": "joy",
+            "emotion_score": 8
+        }}
+        """
+
+        annotation = await self.structured_output.arequest(self.llm, prompt, parse_annotation_response, max_attempts=max_attempts, call_site="annotation")
+        if annotation is not None:
+            return annotation
+
+        print(f"short_term Warning: no valid merged annotation for {description!r} → using defaults")
+        return 5.0, "sadness", 5.0
+
+    def store_memory(self, memory_entry):
+        memory_entry = MemoryNode.from_dict(memory_entry)
         self.recent_memories.append(memory_entry)
         self.whole_memories.append(memory_entry)
+        self.memory_store.bump_version(memory_entry["memory_type"])
+        self.index_plan(memory_entry)
 
-        if memory_type in ["event", "chat"]:
+        if memory_entry["memory_type"] in ["event", "chat"]:
             self.check_reflection_trigger(memory_entry["poignancy"], memory_entry["emotion_intensity"])
 
     def extract_speaker_and_content(self, description):
@@ -251,9 +341,11 @@ class ShortTermMemory:
         except ValueError:
             return "unknown", description
         
-    def emotion_analyze_as_listener(self, description, speaker, max_attempts=100):
+    def emotion_analyze_as_listener(self, description, speaker, max_attempts=None):
+        return self.llm.run(self.aemotion_analyze_as_listener(description, speaker, max_attempts=max_attempts))
+
+    async def aemotion_analyze_as_listener(self, description, speaker, max_attempts=None):
         persona_text = self.format_persona()
-        valid_emotions = {"joy", "sadness", "anger", "fear", "anticipation", "surprise", "trust", "disgust"}
 
         prompt = f"""
         Persona Information:
@@ -276,23 +368,11 @@ class ShortTermMemory:
         Statement from {speaker}: "{description}"
         """
 
-        attempts = 0
-        while attempts < max_attempts:
-            response = self.get_llm_response(prompt).strip()
-
-            try:
-                result = json.loads(response)
-                emotion = result.get("emotion", "").strip().lower()
-                emotion_score = float(result.get("emotion_score", 5.0))
-
-                if emotion in valid_emotions:
-                    return emotion, emotion_score
-            except (json.JSONDecodeError, ValueError, TypeError):
-                pass
-
-            attempts += 1
+        result = await self.structured_output.arequest(self.llm, prompt, parse_emotion_response, max_attempts=max_attempts, call_site="emotion_listener")
+        if result is not None:
+            return result
 
-        print(f"short_term Warning (listener): {max_attempts} attempts reached for statement from {speaker!r}: {description!r} → setting default emotion to 'sadness'")
+        print(f"short_term Warning (listener): no valid emotion for statement from {speaker!r}: {description!r} → setting default emotion to 'sadness'")
         return "sadness", 5.0
 
     def generate_reflection(self):
@@ -300,30 +380,21 @@ class ShortTermMemory:
         questions = self.generate_questions(recent_memory)
         reflections = []
 
-        all_node_ids = []
-
-        # shortterm
-        all_node_ids += [int(m["node_id"].split("-")[0]) for m in self.whole_memories if "node_id" in m]
-
-        # longterm
-        all_node_ids += [int(m["node_id"].split("-")[0]) for m in self.long_term_memory.memory_entries if "node_id" in m]
-
-        current_reflection_id = max(all_node_ids, default=0) + 1
-
         latest_timestamp = max(
-            [m["timestamp"] for m in recent_memory], default=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            [m["timestamp"] for m in recent_memory], default=DatetimeNL.now().strftime("%Y-%m-%d %H:%M:%S")
         )
 
-        for question in questions:
-            relevant_shortterms = self.find_relevant_shortterms(question, recent_memory)
-            reflection_text = self.generate_reflection_text(question, relevant_shortterms)
+        question_embeddings = self.generate_embeddings(questions)
+        reflection_texts = []
+        for question, question_embedding in zip(questions, question_embeddings):
+            relevant_shortterms = self.find_relevant_shortterms(question, recent_memory, question_embedding=question_embedding)
+            reflection_texts.append(self.generate_reflection_text(question, relevant_shortterms))
 
-            poignancy = self.calculate_poignancy(reflection_text)
-            emotion, emotion_score = self.emotion_analyze(reflection_text)
-            embedding = self.generate_embedding(reflection_text)
+        reflection_embeddings = self.generate_embeddings(reflection_texts)
+        reflection_scores = self.llm.gather(*[self.ascore_memory(reflection_text) for reflection_text in reflection_texts])
 
-            next_node_id = f"{current_reflection_id}-0"
-            current_reflection_id += 1
+        for reflection_text, embedding, (poignancy, emotion, emotion_score) in zip(reflection_texts, reflection_embeddings, reflection_scores):
+            next_node_id = self.generate_node_id("thought")
 
             reflection_entry = {
                 "node_id": next_node_id,
@@ -340,8 +411,6 @@ class ShortTermMemory:
 
             reflections.append(reflection_text)
 
-        self.general_memory_id = current_reflection_id
-
         self.recent_memories.clear()
 
         return reflections
@@ -365,7 +434,7 @@ class ShortTermMemory:
         Provide the questions in a numbered list, without explanations.
         """
         try:
-            response = self.get_llm_response(prompt)
+            response = self.get_llm_response(prompt, call_site="reflection_questions")
             questions = [q.strip() for q in response.strip().split("\n") if q.strip()]
             print(f"Generated Questions: {questions}")
             return questions[:3]
@@ -373,8 +442,9 @@ class ShortTermMemory:
             print(f"Error generating questions: {e}")
             return []
 
-    def find_relevant_shortterms(self, question, memory):
-        question_embedding = self.generate_embedding(question)
+    def find_relevant_shortterms(self, question, memory, question_embedding=None):
+        if question_embedding is None:
+            question_embedding = self.generate_embedding(question)
         similarities = []
 
         for m in memory:
@@ -422,7 +492,7 @@ class ShortTermMemory:
         Keep your response to 2–3 sentences.
         """
         try:
-            response = self.get_llm_response(prompt)
+            response = self.get_llm_response(prompt, call_site="reflection")
             reflection = response.strip()
             print(f"Generated Reflection: {reflection}")
             return reflection
@@ -434,3 +504,25 @@ class ShortTermMemory:
     def retrieve_plan(self, memory_type):
         filtered_data = [entry for entry in self.whole_memories if entry.get('memory_type') == memory_type]
         return filtered_data
+
+    def index_plan(self, memory_entry):
+        memory_type = memory_entry.get("memory_type")
+        if memory_type and memory_type.endswith("_plan"):
+            self.latest_plans[memory_type] = memory_entry
+
+    def latest_plan(self, memory_type):
+        """
+        The most recently stored plan of memory_type, or None. Same as retrieve_plan(memory_type)[-1] in O(1).
+        """
+        return self.latest_plans.get(memory_type)
+
+    def plan_schedule(self, memory_type):
+        """
+        PlanSchedule of the latest plan of memory_type; the plan text is only parsed again once a new plan is stored.
+        """
+        plan_entry = self.latest_plans.get(memory_type)
+        cached = self.plan_schedules.get(memory_type)
+        if cached is None or cached[0] is not plan_entry:
+            cached = (plan_entry, PlanSchedule(plan_entry["description"] if plan_entry is not None else ""))
+            self.plan_schedules[memory_type] = cached
+        return cached[1]
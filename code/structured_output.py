@@ -0,0 +1,218 @@
+import difflib
+import json
+import os
+import re
+import threading
+
+VALID_EMOTIONS = ["joy", "sadness", "anger", "fear", "anticipation", "surprise", "trust", "disgust"]
+STRUCTURED_MAX_ATTEMPTS = int(os.environ.get("STRUCTURED_MAX_ATTEMPTS", 3))
+# re-prompts allowed per tick across all agents; once spent, failed parses fall back to defaults
+STRUCTURED_TICK_RETRY_BUDGET = int(os.environ.get("STRUCTURED_TICK_RETRY_BUDGET", 200))
+
+EMOTION_SYNONYMS = {
+    "happy": "joy", "happiness": "joy", "joyful": "joy", "delight": "joy", "contentment": "joy",
+    "relief": "joy", "pride": "joy", "excited": "joy", "amusement": "joy",
+    "sad": "sadness", "sorrow": "sadness", "grief": "sadness", "loneliness": "sadness", "lonely": "sadness",
+    "melancholy": "sadness", "disappointment": "sadness", "despair": "sadness", "regret": "sadness",
+    "guilt": "sadness", "shame": "sadness", "hopelessness": "sadness", "exhaustion": "sadness",
+    "angry": "anger", "frustration": "anger", "frustrated": "anger", "irritation": "anger",
+    "annoyance": "anger", "rage": "anger", "resentment": "anger",
+    "afraid": "fear", "anxiety": "fear", "anxious": "fear", "worry": "fear", "worried": "fear",
+    "nervous": "fear", "nervousness": "fear", "scared": "fear", "stress": "fear", "dread": "fear",
+    "insecurity": "fear", "panic": "fear",
+    "hope": "anticipation", "hopeful": "anticipation", "excitement": "anticipation", "eagerness": "anticipation",
+    "expectation": "anticipation", "curiosity": "anticipation", "interest": "anticipation", "optimism": "anticipation",
+    "surprised": "surprise", "shock": "surprise", "amazement": "surprise", "astonishment": "surprise",
+    "confusion": "surprise",
+    "trusting": "trust", "gratitude": "trust", "love": "trust", "acceptance": "trust", "admiration": "trust",
+    "comfort": "trust", "empathy": "trust", "calm": "trust", "support": "trust",
+    "disgusted": "disgust", "contempt": "disgust", "aversion": "disgust", "revulsion": "disgust",
+}
+
+
+def extract_json(text):
+    """
+    Finds the JSON object in an LLM response.
+    Returns (dict or None, repaired) where repaired is True if the object was only found after stripping
+    code fences or surrounding text, or after fixing trailing commas, single quotes or unquoted keys.
+    """
+    if not text:
+        return None, False
+    text = text.strip()
+    try:
+        result = json.loads(text)
+        return (result, False) if isinstance(result, dict) else (None, False)
+    except json.JSONDecodeError:
+        pass
+
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return None, False
+    candidate = text[start:end + 1]
+    fixes = [
+        lambda s: s,
+        lambda s: re.sub(r",\s*([}\]])", r"\1", s),
+        lambda s: s.replace("'", '"'),
+        lambda s: re.sub(r"([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:", r'\1"\2":', s),
+    ]
+    for fix in fixes:
+        candidate = fix(candidate)
+        try:
+            result = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(result, dict):
+            return result, True
+    return None, False
+
+
+def normalize_emotion(label):
+    """
+    Maps a label onto one of VALID_EMOTIONS, via EMOTION_SYNONYMS or a close spelling match.
+    Returns (emotion or None, repaired).
+    """
+    emotion = re.sub(r"[^a-z]", "", str(label or "").lower())
+    if emotion in VALID_EMOTIONS:
+        return emotion, emotion != label
+    if emotion in EMOTION_SYNONYMS:
+        return EMOTION_SYNONYMS[emotion], True
+    match = difflib.get_close_matches(emotion, VALID_EMOTIONS + list(EMOTION_SYNONYMS), n=1, cutoff=0.8)
+    if match:
+        return EMOTION_SYNONYMS.get(match[0], match[0]), True
+    return None, False
+
+
+def parse_score(value, default=5.0, low=1.0, high=10.0):
+    """
+    Reads a 1-10 score from a number or text ("7", "7/10", "Score: 7.5"), clamped to [low, high].
+    Returns (score, repaired); a missing value or one without any number gives (default, True).
+    """
+    if value is None:
+        return default, True
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        score, repaired = float(value), False
+    else:
+        text = str(value).strip()
+        try:
+            score, repaired = float(text), False
+        except ValueError:
+            match = re.search(r"-?\d+(?:\.\d+)?", text)
+            if not match:
+                return default, True
+            score, repaired = float(match.group(0)), True
+    if score < low or score > high:
+        return min(high, max(low, score)), True
+    return score, repaired
+
+
+def parse_emotion_response(response):
+    """
+    Parses {"emotion": ..., "emotion_score": ...}. Falls back to picking "emotion: x" and a number out of
+    non-JSON text. Returns ((emotion, emotion_score) or None, repaired).
+    """
+    result, repaired = extract_json(response)
+    if result is None:
+        match = re.search(r"emotion\W+([A-Za-z]+)", response or "", re.IGNORECASE)
+        if not match:
+            return None, False
+        score_match = re.search(r"(?:score|intensity)\W+(\d+(?:\.\d+)?)", response, re.IGNORECASE)
+        result = {"emotion": match.group(1), "emotion_score": score_match.group(1) if score_match else 5.0}
+        repaired = True
+
+    emotion, emotion_repaired = normalize_emotion(result.get("emotion"))
+    if emotion is None:
+        return None, False
+    # a missing score is defaulted, which counts as a repair
+    emotion_score, score_repaired = parse_score(result.get("emotion_score"))
+    return (emotion, emotion_score), repaired or emotion_repaired or score_repaired
+
+
+def parse_annotation_response(response):
+    """
+    Parses {"poignancy": 1-10, "emotion": ..., "emotion_score": 1-10}.
+    Returns ((poignancy, emotion, emotion_intensity) or None, repaired).
+    """
+    parsed, repaired = parse_emotion_response(response)
+    if parsed is None:
+        return None, False
+    result, _ = extract_json(response)
+    poignancy, poignancy_repaired = parse_score((result or {}).get("poignancy"))
+    return (poignancy,) + parsed, repaired or poignancy_repaired
+
+
+class StructuredOutput:
+    """
+    Process-wide retry policy and metrics for prompts whose answer has to be parsed.
+    - Each call re-prompts at most max_attempts - 1 times.
+    - All calls share a re-prompt budget per tick (reset by the scheduler with start_tick()).
+    - Counts how answers were obtained: parsed as-is, repaired locally, after a re-prompt, or defaulted.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, max_attempts=STRUCTURED_MAX_ATTEMPTS, tick_retry_budget=STRUCTURED_TICK_RETRY_BUDGET):
+        self.max_attempts = max_attempts
+        self.tick_retry_budget = tick_retry_budget
+        self.lock = threading.Lock()
+        self.retries_left = tick_retry_budget
+        self.counts = {"clean": 0, "repaired": 0, "reprompts": 0, "recovered": 0, "defaults": 0, "budget_exhausted": 0}
+
+    def start_tick(self):
+        with self.lock:
+            self.retries_left = self.tick_retry_budget
+
+    def take_retry(self):
+        with self.lock:
+            if self.retries_left <= 0:
+                self.counts["budget_exhausted"] += 1
+                return False
+            self.retries_left -= 1
+            self.counts["reprompts"] += 1
+            return True
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    async def arequest(self, llm, prompt, parse, max_attempts=None, cache=True, call_site=None):
+        """
+        Sends prompt through llm (an OpenAILLM) and returns parse(response)'s value, re-prompting within the
+        per-call and per-tick limits. A cached answer that fails to parse is dropped before re-prompting.
+        Returns None when no attempt produced a parsable answer. A failed request (the backend's request_errors,
+        e.g. any API error once retries are spent, or a filtered prompt) counts as a failed attempt, so the
+        caller falls back to its default; anything else is a bug and is raised.
+        """
+        max_attempts = max_attempts or self.max_attempts
+        for attempt in range(max_attempts):
+            if attempt and not self.take_retry():
+                break
+            try:
+                response = await llm.aget_llm_response(prompt, cache=cache, call_site=call_site)
+            except llm.backend.request_errors as e:
+                print(f"{call_site or 'structured output'} request failed ({type(e).__name__}), attempt {attempt + 1}/{max_attempts}")
+                response = ""
+            value, repaired = parse(response)
+            if value is not None:
+                self.count("recovered" if attempt else ("repaired" if repaired else "clean"))
+                return value
+            if cache:
+                await llm.aforget_response(prompt)
+
+        self.count("defaults")
+        return None
+
+    def request(self, llm, prompt, parse, max_attempts=None, cache=True, call_site=None):
+        return llm.run(self.arequest(llm, prompt, parse, max_attempts=max_attempts, cache=cache, call_site=call_site))
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats["retries_left"] = self.retries_left
+            return stats
@@ -1,9 +1,71 @@
 import time
 import os
+import threading
 from datetime import datetime, timedelta
 
 SIMULATION_START = datetime.strptime("2025-02-11 00:15:00", "%Y-%m-%d %H:%M:%S")
-ACTUAL_START = None
+TURN_LENGTH = timedelta(minutes=15)
+
+
+class WallClock:
+    """
+    Game time runs `speed` times faster than wall time from the first call to now().
+    Turns are paced by sleeping until the next turn boundary.
+    """
+    is_virtual = False
+
+    def __init__(self, start=SIMULATION_START, speed=3):
+        self.simulation_start = start
+        self.speed = speed
+        self.actual_start = None
+
+    def start(self):
+        self.actual_start = datetime.now().replace(microsecond=0)
+        return self.actual_start
+
+    def now(self):
+        if self.actual_start is None:
+            self.start()
+        actual_elapsed = datetime.now().replace(microsecond=0) - self.actual_start
+        return self.simulation_start + actual_elapsed * self.speed
+
+    def sleep(self, game_seconds):
+        time.sleep(game_seconds / self.speed)
+
+    def advance(self, delta=TURN_LENGTH):
+        # wall time advances on its own; nothing to do
+        return self.now()
+
+
+class VirtualClock:
+    """
+    Explicit-tick clock: game time only moves when advance() is called (once per turn, after every agent finished
+    its step), so runs go as fast as the LLM backend allows and are reproducible.
+    """
+    is_virtual = True
+
+    def __init__(self, start=SIMULATION_START, turn_length=TURN_LENGTH):
+        self.current = start
+        self.turn_length = turn_length
+        self.lock = threading.Lock()
+
+    def start(self):
+        return self.now()
+
+    def now(self):
+        with self.lock:
+            return self.current
+
+    def sleep(self, game_seconds):
+        pass
+
+    def advance(self, delta=None):
+        with self.lock:
+            self.current += delta if delta is not None else self.turn_length
+            return self.current
+
+
+CLOCK = WallClock()
 
 class DatetimeNL:
 
@@ -70,26 +132,31 @@ class DatetimeNL:
             raise ValueError("end_date must be later or equal to start_date")
         return date_range
 
+    @staticmethod
+    def set_clock(clock):
+        global CLOCK
+        CLOCK = clock
+        return CLOCK
+
+    @staticmethod
+    def get_clock():
+        return CLOCK
+
     @staticmethod
     def initialize_simulation_start():
-        global ACTUAL_START
-        ACTUAL_START = datetime.now().replace(microsecond=0)
-        return ACTUAL_START
+        return CLOCK.start()
 
     @staticmethod
-    def accelerated_time(n = 3) -> datetime:
+    def now() -> datetime:
+        return CLOCK.now()
 
-        global ACTUAL_START
-        if ACTUAL_START is None:
-            DatetimeNL.initialize_simulation_start()
-        actual_elapsed = datetime.now().replace(microsecond=0) - ACTUAL_START  
-        accelerated_elapsed = actual_elapsed * n  
-        new_datetime = SIMULATION_START + accelerated_elapsed
-        return new_datetime
+    @staticmethod
+    def accelerated_time() -> datetime:
+        return CLOCK.now()
 
     @staticmethod
     def convert_time_string(time_str):
-        curr_time = DatetimeNL.accelerated_time()
+        curr_time = DatetimeNL.now()
         hour_part = int(time_str.split(":")[0])
         
         if hour_part > 12:
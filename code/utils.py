@@ -1,10 +1,15 @@
 from datetime import datetime
 from time_utils import DatetimeNL
 from agent import Agent
+import journal
 import json
+import numpy as np
+from memory_node import MemoryNode
 import time
 
 def load_json_file(filename):
+    if filename.endswith(journal.JOURNAL_SUFFIX):
+        return journal.load_journal(filename)
     with open(filename, "r", encoding="utf-8") as f:
         data = json.load(f)
     return data
@@ -22,7 +27,10 @@ def create_agent(filename):
     situation = data["situation"]
     auto_thought = data["auto_thought"]
 
-    agent = Agent(filename, name, agent_type, intermediate_belief, intermediate_belief_depression, history, behavior, description, auto_thought, situation)
+    # the memory store takes its nodes from the same parse instead of reading the file again
+    agent = Agent(filename, name, agent_type, intermediate_belief, intermediate_belief_depression, history, behavior, description, auto_thought, situation, memory_data=data)
+    agent.relationships.update(data.get("relationships", {}))
+    agent.relationship_summary.update(data.get("relationship_summary", {}))
     return agent
 
 def save_agent_json(filename,agent):
@@ -48,4 +56,8 @@ def save_agent_json(filename,agent):
 def datetime_converter(o):
         if isinstance(o, datetime):
             return o.strftime("%Y-%m-%d %H:%M:%S")
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        if isinstance(o, MemoryNode):
+            return o.to_dict()
         raise TypeError(f"Type {type(o)} not serializable")
\ No newline at end of file